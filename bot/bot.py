@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import random
@@ -8,6 +9,8 @@ from discord.ext.commands import Context
 import pomice
 import dotenv
 from bot.utils.database import Database
+from bot.utils.deletions import DeletionScheduler
+from bot.utils.lavalink import NodeMonitor, create_node, load_node_sessions, node_configs
 
 dotenv.load_dotenv()
 dev_guild = discord.Object(id=863032719314911262)
@@ -42,6 +45,9 @@ class MyBot(commands.Bot):
 
         self.scheduler = AsyncIOScheduler()
         self.pomice = pomice.NodePool()
+        self.node_monitor = NodeMonitor(self)
+        self.nodes_ready = asyncio.Event()
+        self.deletions = DeletionScheduler()
 
         self.economy_enabled = False
         self.is_docker = os.getenv("IS_DOCKER", False)
@@ -71,25 +77,22 @@ class MyBot(commands.Bot):
         )
 
     async def start_nodes(self):
+        started = 0
+        sessions = await load_node_sessions(self.db)
 
-        host = os.environ["LAVALINK_HOST"] if not self.is_docker else "lavalink"
-        port = int(os.environ["LAVALINK_PORT"])
-        password = os.environ["LAVALINK_PASSWORD"]
-        identifier = os.environ.get("LAVALINK_IDENTIFIER", "MAIN")
+        for config in node_configs(self.is_docker):
+            if config.identifier in self.pomice.nodes:
+                started += 1
+                continue
 
-        try:
-            await self.pomice.create_node(
-                bot=self, 
-                host=host, 
-                port=port, 
-                password=password, 
-                identifier=identifier,
-            )
-            logging.info("Lavalink node started successfully.")
-            return True
-        except Exception as e:
-            logging.error(f"Failed to start Lavalink node: {e}")
-            return False
+            try:
+                await create_node(self, config, session_id=sessions.get(config.identifier))
+                logging.info(f"Lavalink node {config.identifier} started successfully.")
+                started += 1
+            except Exception as e:
+                logging.error(f"Failed to start Lavalink node {config.identifier}: {e}")
+
+        return started > 0
 
     async def do_sync(self) -> None:
         mode = "Development" if self.dev else "Production"
@@ -107,8 +110,19 @@ class MyBot(commands.Bot):
         logging.info("Shutting down.")
         try:
             self.scheduler.shutdown(wait=False)
-            await self.pomice.cleanup()
-            await self.db.close()
+            self.node_monitor.stop()
+            self.deletions.stop()
+
+            # Players are left running on Lavalink so the next start can resume them
+            music = self.get_cog('music')
+            if music:
+                await music.save_players()
+
+            # Client.close() would leave every voice channel, forget the players instead
+            for voice in list(self.voice_clients):
+                voice.cleanup()
+
+            await self.db.db_close()
         except Exception as e:
             logger.error(f"Error during shutdown: {e}")
         await super().close()
@@ -122,6 +136,8 @@ class MyBot(commands.Bot):
 
     async def on_ready(self):
         await self.start_nodes()
+        self.nodes_ready.set()
+        self.node_monitor.start()
         logging.info("READY.")
         self.change_status.start()
 
@@ -2,6 +2,9 @@ from discord.ext import commands
 from discord import Object, Embed, Color
 from typing import Literal, Optional, TYPE_CHECKING
 
+from bot.cogs.utils.music import governor, lyrics, percentile, recommendations, resolver, search, spotify_token, transitions
+from bot.utils.lavalink import is_node_up, node_load, node_penalty
+
 if TYPE_CHECKING:
     from bot import MyBot
 
@@ -82,7 +85,7 @@ class Admin(commands.Cog):
         if started:
             embed = Embed(
                 title="✅ Lavalink Node Started",
-                description="The Lavalink node has been started successfully.",
+                description="The Lavalink nodes have been started successfully. Use `nodes` to see their load.",
                 color=Color.green()
             )
         else:
@@ -94,5 +97,152 @@ class Admin(commands.Cog):
 
         await ctx.send(embed=embed)
 
+    @commands.command(name='nodes')
+    @commands.guild_only()
+    @commands.is_owner()
+    async def nodes(self, ctx):
+        nodes = self.bot.pomice.nodes
+        embed = Embed(title="🎛️ Lavalink Nodes", color=self.bot.color)
+
+        if not nodes:
+            embed.description = "No Lavalink nodes are registered."
+
+        monitor = self.bot.node_monitor
+        for identifier, node in nodes.items():
+            load = node_load(node)
+            status = "🟢 Up" if is_node_up(node) else "🔴 Down"
+            latency = monitor.latency.get(identifier)
+            embed.add_field(
+                name=f"{identifier} - {status}",
+                value=(
+                    f"Players: {load['playing']} playing / {load['players']} total\n"
+                    f"CPU: {load['system_load']:.0%} system | {load['lavalink_load']:.0%} lavalink\n"
+                    f"Frames: {load['deficit']} deficit | {load['nulled']} nulled\n"
+                    f"REST latency: {f'{latency:.0f}ms' if latency is not None else 'N/A'}\n"
+                    f"Penalty: {node_penalty(node):.1f}"
+                ),
+                inline=False
+            )
+
+        if monitor.recoveries:
+            source, target, elapsed = monitor.recoveries[-1]
+            embed.set_footer(text=f"Last recovery: {source} -> {target} in {elapsed:.1f}s")
+
+        await ctx.send(embed=embed)
+
+    @commands.command(name='music_stats')
+    @commands.guild_only()
+    @commands.is_owner()
+    async def music_stats(self, ctx):
+        embed = Embed(title="🎵 Music Stats", color=self.bot.color)
+
+        for name, stats in resolver.stats().items():
+            embed.add_field(
+                name=f"{name.title()} cache",
+                value=(
+                    f"Entries: {stats['size']}/{stats['maxsize']} ({stats['weight']} tracks)\n"
+                    f"Hits: {stats['hits']} | Misses: {stats['misses']}\n"
+                    f"Hit rate: {stats['hit_rate']:.1%}"
+                ),
+            )
+
+        stats = governor.stats()
+        embed.add_field(
+            name="Search governor",
+            value=(
+                f"In flight: {stats['in_flight']}/{stats['capacity']} | Waiting: {stats['waiting']}\n"
+                f"Throttled: {stats['throttled']}\n"
+                f"Songs over limits: {stats['capped']}"
+            ),
+        )
+
+        order = [source.value for source in search.order()]
+        embed.add_field(
+            name=f"Search sources ({'race' if search.race else 'fallback'})",
+            value="\n".join(
+                f"`{name}` {stats['requests']} req | {stats['success']:.0%} ok | "
+                f"p95 {stats['p95'] * 1000:.0f}ms" if stats['p95'] is not None else f"`{name}` no data"
+                for name, stats in sorted(search.source_stats().items(), key=lambda item: order.index(item[0]))
+            ),
+            inline=False,
+        )
+
+        stats = recommendations.stats()
+        embed.add_field(
+            name="Autoplay",
+            value=(
+                f"Recommendations cached: {stats['size']} ({stats['hit_rate']:.1%} hits)\n"
+                f"Spotify token requests: {spotify_token.requests}"
+            ),
+        )
+
+        stats = lyrics.stats()
+        embed.add_field(
+            name="Lyrics cache",
+            value=(
+                f"Entries: {stats['size']} ({stats['bytes'] / 1024:.0f}/{stats['maxbytes'] / 1024:.0f} KiB)\n"
+                f"Hit rate: {stats['hit_rate']:.1%}"
+            ),
+        )
+
+        if transitions:
+            embed.add_field(
+                name="Track transitions",
+                value=(
+                    f"Samples: {len(transitions)}\n"
+                    f"p50: {percentile(transitions, 0.5) * 1000:.0f}ms | "
+                    f"p95: {percentile(transitions, 0.95) * 1000:.0f}ms\n"
+                    f"Max: {max(transitions) * 1000:.0f}ms"
+                ),
+            )
+
+        deletions = self.bot.deletions.stats()
+        embed.add_field(
+            name="Message deletions",
+            value=(
+                f"Pending: {deletions['pending']}\n"
+                f"Deleted: {deletions['deleted']} | Failed: {deletions['failed']}"
+            ),
+        )
+
+        music = self.bot.get_cog('music')
+        if music:
+            renders = music.guilds.render_stats()
+            embed.add_field(
+                name="Message renders",
+                value=(
+                    f"Requested: {renders['requested']}\n"
+                    f"Coalesced: {renders['coalesced']}\n"
+                    f"Edits: {renders['renders']}"
+                ),
+            )
+
+            queues = music.guilds.queues.stats()
+            embed.add_field(
+                name="Queue persistence",
+                value=(
+                    f"Changes: {queues['marked']}\n"
+                    f"Flushes: {queues['flushes']}\n"
+                    f"Pending: {queues['pending']}"
+                ),
+            )
+
+            live = music.live.stats()
+            embed.add_field(
+                name="Live now playing",
+                value=(
+                    f"Guilds: {live['live']} | Every {live['interval']:.1f}s\n"
+                    f"Frames: {live['frames']} | Dropped: {live['dropped']}\n"
+                    f"Rate limited: {live['limited']}"
+                ),
+            )
+
+            embed.add_field(
+                name="Song requests",
+                value=f"Rejected while busy: {sum(worker.rejected for worker in music._workers.values())}",
+            )
+
+        await ctx.send(embed=embed)
+
 async def setup(bot):
     await bot.add_cog(Admin(bot))
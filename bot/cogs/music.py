@@ -1,31 +1,62 @@
-import re
-from typing import cast
+import asyncio
+import contextlib
+import functools
+import logging
+from typing import Dict, List, cast
 import discord
 from discord import app_commands
 from discord.ext import commands
-from pomice import SearchType, Track
+from pomice import Track
 import pomice
 from typing import TYPE_CHECKING
 from bot.cogs.utils.music import (
+    apply_controls,
+    GuildRegistry,
+    IngestWorker,
+    LiveTicker,
     MusicPlayer,
+    search,
+    UNAVAILABLE,
+    decode_valid_tracks,
     default_embed,
-    disabled_buttons, 
-    reset_embeds, 
-    get_message
+    governor,
+    request_queries,
+    reset_embeds,
 )
-from bot.cogs.views.music import MusicButtons
+from bot.cogs.utils.music_store import (
+    delete_player,
+    delete_playlist,
+    find_playlist,
+    list_playlists,
+    load_players,
+    load_playlist,
+    load_queue,
+    save_playlist,
+)
+from bot.cogs.utils.paginator import Paginator
+from bot.cogs.views.music import MusicButtons, QueueBrowser, QueuePages
+from bot.utils.lavalink import best_node, discard_orphans, is_node_up
 
 if TYPE_CHECKING:
     from bot import MyBot
     from bot.utils.database import Database
+    from bot.cogs.utils.music import GuildState
+    from bot.utils.types import AttrDict
+
+log = logging.getLogger(__name__)
+
+RECOVERY_CONCURRENCY = 5
+RECOVERY_HISTORY = 10
 
 class Music(commands.Cog, name='music', description='Play, Skip, Seek and more using the music commands'):
     def __init__(self, bot: 'MyBot'):
         self.bot = bot
         self.db: 'Database' = self.bot.db
         self.view = MusicButtons(bot, db=self.db, parent=self)
-        self.channels = []
-        self.last_songs = []
+        self.guilds = GuildRegistry(self.db)
+        self.live = LiveTicker(bot, self.guilds, self.view)
+        self._workers: Dict[int, IngestWorker] = {}
+        self._recovered = False
         self.emoji_guide = (
             "\nMusic Controls:\n"
             "<:Repeat:1158995878615453746> Repeat Song | "
@@ -41,18 +72,24 @@ class Music(commands.Cog, name='music', description='Play, Skip, Seek and more u
             "<:lyrics:1394167977351450776> Lyrics\n"
         )
 
+    async def cog_load(self) -> None:
+        self.live.start()
+
+    async def cog_unload(self) -> None:
+        self.live.stop()
+
     @app_commands.command(name='music-setup', description='Create a music channel for you to play and control music.')
     async def _setup(self, itr: discord.Interaction, channel: discord.TextChannel = None):
         await itr.response.defer()
-        state = await self.db.fetchone("SELECT channel_id FROM music WHERE guild_id = %s", itr.guild.id)
+        state = self.guilds.get(itr.guild.id)
 
-        if state and state['channel_id']:
-            existing_channel = itr.guild.get_channel(state['channel_id'])
+        if state and state.channel_id:
+            existing_channel = itr.guild.get_channel(state.channel_id)
             if existing_channel:
                 embed = discord.Embed(
                     title='Music Channel Already Exists',
                     color=0xFF0000,
-                    description=f'Channel: {itr.guild.get_channel(state["channel_id"]).mention}'
+                    description=f'Channel: {existing_channel.mention}'
                 )
                 embed.set_footer(text='Use /music-destroy to remove the channel')
                 return await itr.followup.send(embed=embed, ephemeral=True)
@@ -62,11 +99,11 @@ class Music(commands.Cog, name='music', description='Play, Skip, Seek and more u
         else:
             await channel.edit(topic=self.emoji_guide)
 
-        self.channels.append(channel.id)
         embed, embed2 = default_embed(self.bot)
-        disabled_buttons(self.view.children)
-
         queue_message = await channel.send(embed=embed2)
+
+        # The view is shared with every guild, set it right before it is sent
+        apply_controls(self.view, itr.guild, self.guilds)
         song_msg = await channel.send(embed=embed, view=self.view)
 
         await itr.followup.send(embed=discord.Embed(
@@ -74,47 +111,170 @@ class Music(commands.Cog, name='music', description='Play, Skip, Seek and more u
             color=0x00ff00,
             description=channel.mention)
         )
-        
-        guild = await self.db.fetchone("SELECT guild_id FROM music WHERE guild_id = %s", itr.guild.id)
-        
-        if not guild:
-            await self.db.execute(
-                "INSERT INTO music (guild_id, channel_id, message_id, queue_id) VALUES (%s,%s,%s,%s)",
-                itr.guild.id, channel.id, song_msg.id, queue_message.id
+
+        await self.guilds.save(itr.guild.id, channel.id, song_msg.id, queue_message.id)
+
+    @app_commands.command(name='queue', description='Browse the whole queue, jump to a position and rearrange songs.')
+    async def _queue(self, itr: discord.Interaction):
+        player = cast(MusicPlayer, itr.guild.voice_client)
+        if not player:
+            return await itr.response.send_message('Nothing is playing right now.', ephemeral=True)
+
+        await itr.response.defer(ephemeral=True)
+        await Paginator(itr, QueuePages(player, self.guilds), view_cls=QueueBrowser).start()
+
+    @app_commands.command(name='music-live', description='Toggle a live progress bar and synced lyrics on the music controller.')
+    async def _live(self, itr: discord.Interaction):
+        state = self.guilds.get(itr.guild.id)
+        if not state:
+            return await itr.response.send_message('Create a music channel with /music-setup first.', ephemeral=True)
+
+        state.live = not state.live
+        await itr.response.send_message(
+            f"Live now playing is {'enabled' if state.live else 'disabled'}.", ephemeral=True
+        )
+
+        player = cast(MusicPlayer, itr.guild.voice_client)
+        if player and player.current:
+            self.guilds.schedule(itr.guild, 'controller', lambda: player._render_controller(self.guilds, self.view))
+
+    playlist = app_commands.Group(name='playlist', description='Save the queue as a playlist of this server and load it later.')
+
+    async def playlist_autocomplete(self, itr: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        rows = await list_playlists(self.db, itr.guild.id, current)
+        return [app_commands.Choice(name=f"{row.name} ({row.track_count} songs)", value=row.name) for row in rows]
+
+    @staticmethod
+    def _owns_playlist(itr: discord.Interaction, row: 'AttrDict') -> bool:
+        """ Only the member who saved a playlist or a server manager may replace or delete it """
+        return row.created_by == itr.user.id or itr.user.guild_permissions.manage_guild
+
+    @playlist.command(name='save', description='Save the current song and the queue as a playlist.')
+    @app_commands.describe(name='Saving under an existing name replaces that playlist.')
+    async def _playlist_save(self, itr: discord.Interaction, name: app_commands.Range[str, 1, 64]):
+        player = cast(MusicPlayer, itr.guild.voice_client)
+        encoded = player.playlist() if player else []
+        if not encoded:
+            return await itr.response.send_message('There is nothing in the queue to save.', ephemeral=True)
+
+        name = name.strip()
+        existing = await find_playlist(self.db, itr.guild.id, name)
+        if existing and not self._owns_playlist(itr, existing):
+            return await itr.response.send_message(
+                f'**{name}** belongs to another member. Pick a different name.', ephemeral=True
             )
 
-        else:
-            await self.db.execute(
-                "UPDATE music SET channel_id=%s, message_id=%s, queue_id=%s WHERE guild_id = %s",
-                channel.id, song_msg.id, queue_message.id, itr.guild.id
+        await save_playlist(self.db, itr.guild.id, name, encoded, itr.user.id)
+        await itr.response.send_message(
+            f"{'Replaced' if existing else 'Saved'} **{name}** with {len(encoded)} songs.", ephemeral=True
+        )
+
+    @playlist.command(name='load', description='Add a saved playlist to the queue.')
+    @app_commands.autocomplete(name=playlist_autocomplete)
+    async def _playlist_load(self, itr: discord.Interaction, name: str):
+        # Players only leave voice through the music channel's reset, so there has to be one
+        if not self.guilds.get(itr.guild.id):
+            return await itr.response.send_message('Create a music channel with /music-setup first.', ephemeral=True)
+
+        player = cast(MusicPlayer, itr.guild.voice_client)
+        if not itr.user.voice:
+            return await itr.response.send_message('You must be in a vc to listen to music', ephemeral=True)
+        if player and itr.user.voice.channel.id != player.channel.id:
+            return await itr.response.send_message('You must be in the same vc to listen to music', ephemeral=True)
+
+        await itr.response.defer(ephemeral=True)
+        encoded = await load_playlist(self.db, itr.guild.id, name)
+        if encoded is None:
+            return await itr.followup.send(f'There is no playlist called **{name}**.', ephemeral=True)
+
+        try:
+            if not player:
+                player = await itr.user.voice.channel.connect(cls=MusicPlayer)
+
+            allowed = governor.fit(player, encoded)
+            if not allowed:
+                return await itr.followup.send(f'The queue is full ({governor.max_queue} songs).', ephemeral=True)
+
+            # The whole playlist is one decode request, it still takes a search slot like any other Lavalink call
+            async with governor.slot(itr.guild.id):
+                tracks = await decode_valid_tracks(player.node, allowed)
+        except pomice.PomiceException:
+            return await itr.followup.send(UNAVAILABLE, ephemeral=True)
+
+        for track in tracks:
+            track.requester = itr.user
+        player.queue.extend(tracks)
+
+        if not player.is_playing and not player.queue.is_empty:
+            await player.play(player.queue.get())
+        await player.update_queue(self.guilds)
+
+        message = f'Added {len(tracks)} songs from **{name}** to the queue.'
+        if len(allowed) < len(encoded):
+            message += f' {len(encoded) - len(allowed)} songs were skipped by the queue limits.'
+        await itr.followup.send(message, ephemeral=True)
+
+    @playlist.command(name='list', description='Show the playlists saved in this server.')
+    async def _playlist_list(self, itr: discord.Interaction):
+        rows = await list_playlists(self.db, itr.guild.id)
+        embed = discord.Embed(
+            title='Saved Playlists',
+            description='\n'.join(
+                f"**{row.name}** - {row.track_count} songs, saved by <@{row.created_by}>" for row in rows
+            ) or 'No playlists saved yet. Use /playlist save to create one.',
+            color=self.bot.color,
+        )
+        await itr.response.send_message(embed=embed, ephemeral=True)
+
+    @playlist.command(name='delete', description='Delete a saved playlist.')
+    @app_commands.autocomplete(name=playlist_autocomplete)
+    async def _playlist_delete(self, itr: discord.Interaction, name: str):
+        row = await find_playlist(self.db, itr.guild.id, name)
+        if not row:
+            return await itr.response.send_message(f'There is no playlist called **{name}**.', ephemeral=True)
+
+        if not self._owns_playlist(itr, row):
+            return await itr.response.send_message(
+                'Only the member who saved this playlist or a server manager can delete it.', ephemeral=True
             )
 
+        await delete_playlist(self.db, itr.guild.id, name)
+        await itr.response.send_message(f'Deleted **{name}**.', ephemeral=True)
+
     @commands.Cog.listener()
     async def on_pomice_track_start(self, player: MusicPlayer, _: Track):
-        await player.now_playing(self.db, self.view)
+        player.track_started()
+        await player.now_playing(self.guilds, self.view)
+        player.prefetch_recommendations(self.guilds)
+        player.prefetch_lyrics()
 
     @commands.Cog.listener()
     async def on_pomice_track_end(self, player: MusicPlayer, old_track: Track, _: str):
-
-        play_last = old_track.info.get('play_last', False) if old_track else None
-        previous = self.last_songs.pop() if len(self.last_songs) != 0 else None
+        # The next track goes to Lavalink before anything else, renders and writes are scheduled after
+        player.track_ended()
+        state = self.guilds.get(player.guild.id)
+        play_last = old_track.info.pop('play_last', False) if old_track else False
         next_track = None
 
-        if play_last and previous:
-            next_track = await player.build_track(identifier=previous)
-            await player.update_queue(self.db)
-            return await player.play(next_track)
+        if play_last and state and state.history:
+            previous = state.history.pop()
+            player.queue.put_at_front(old_track)
+            await player.play(previous)
+            return await player.update_queue(self.guilds)
 
-        if not player.queue.loop_mode:
-            self.last_songs.append(old_track.track_id) if old_track else None
+        if old_track and state and not player.queue.loop_mode:
+            state.history.append(old_track)
+
+        if player.queue.is_empty:
+            player.take_autoplay()
 
         try:
             next_track = player.queue.get()
         except pomice.exceptions.QueueEmpty:
             return await reset_embeds(self, player)
-                    
-        await player.update_queue(self.db)
-        return await player.play(next_track)
+
+        await player.play(next_track)
+        await player.update_queue(self.guilds)
 
     @commands.Cog.listener()
     async def on_pomice_track_exception(self, data: dict, player: MusicPlayer):
@@ -123,103 +283,297 @@ class Music(commands.Cog, name='music', description='Play, Skip, Seek and more u
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
 
-        if message.channel.id not in self.channels:
+        state = self.guilds.by_channel(message.channel.id)
+        if not state:
             return 
             
         if message.author.bot:
             return
 
-        guild = await self.db.fetchone("SELECT * FROM music WHERE guild_id = %s", message.guild.id)
-        if not guild:
-            return
+        worker = self._workers.get(message.guild.id)
+        if not worker:
+            worker = self._workers[message.guild.id] = IngestWorker(self._ingest)
 
-        player: MusicPlayer
-        player = cast(MusicPlayer, message.guild.voice_client)
-        if not player:
-            if not message.author.voice:
-                await message.channel.send('Please join a voice channel to use music features.', delete_after=5)
-                return await message.delete()
+        if not worker.submit(message):
+            msg = await message.channel.send("The queue is busy right now. Please try again in a moment.")
+            self.bot.deletions.schedule(msg.delete, 5)
+            await message.delete()
 
-            try:
-                player = await message.author.voice.channel.connect(cls=MusicPlayer)
-            except pomice.exceptions.NodeNotAvailable:
-                await message.channel.send('The music service is currently unavailable. Please try again shortly.', delete_after=10)
-                return await message.delete()
+    async def _ingest(self, messages: List[discord.Message]) -> None:
+        """ Resolve a batch of song requests together and queue the results in the order they were sent """
+        accepted = [message for message in messages if await self._accept(message)]
+        if not accepted:
+            return
 
-        if guild['locked']:
-            if player.playing:
-                await message.channel.send("The music channel is locked. Adding new songs is temporarily disabled.", delete_after=5)
-                return await message.delete()
-            await self.db.execute("UPDATE music SET locked = %s WHERE guild_id = %s", False, message.guild.id)
+        guild = accepted[0].guild
+        worker = self._workers[guild.id]
+        player = cast(MusicPlayer, guild.voice_client)
+
+        # Requests are admitted one at a time, only the ones past the guild's share are turned away
+        requests, throttled, reserved = [], [], 0
+        for message in accepted:
+            queries = request_queries(message.content)
+            if governor.admit(guild.id, len(queries), reserved):
+                requests.append((message, queries))
+                reserved += len(queries)
+            else:
+                throttled.append(message)
+
+        if throttled:
+            await self._reject(throttled, 'Song search is busy right now. Please wait a few seconds and try again.', 5)
+        if not requests:
+            return
+        accepted = [message for message, _ in requests]
 
+        # Searching only needs a node's REST API, so the voice handshake runs alongside it
         try:
-            is_spotify = re.match(r'https?://open.spotify.com/(?P<type>album|playlist|track|artist)/(?P<id>[a-zA-Z0-9]+)', message.content)
-            search_type = None if is_spotify else SearchType.ytmsearch
-            tracks = await player.get_tracks(message.content, search_type=search_type)
-        except Exception as e:
-            tracks = None
-            await message.delete()
-            print(repr(e))
+            node = player.node if player else best_node()
+        except pomice.exceptions.NoNodesAvailable:
+            return await self._reject(accepted, UNAVAILABLE, 10)
 
-        if not tracks:
-            await message.channel.send(f"No matching tracks were found. Please refine your search and try again.", delete_after=5)
+        connect = None
+        if not player:
+            # The checks above awaited, so authors may have left voice since they were accepted
+            voice = next((message.author.voice for message in accepted if message.author.voice), None)
+            if not voice:
+                return await self._reject(accepted, 'Please join a voice channel to use music features.', 5)
+            connect = asyncio.create_task(voice.channel.connect(cls=functools.partial(MusicPlayer, node=node)))
+
+        async def resolve(query: str):
+            async with worker.limit, governor.slot(guild.id):
+                try:
+                    return await search.resolve(node, query)
+                except Exception as e:
+                    # Kept apart from an empty result, the query may well match once Lavalink is back
+                    log.warning(f"Failed to resolve {query!r}: {e!r}")
+                    return e
+
+        results = iter(await asyncio.gather(*(resolve(query) for _, queries in requests for query in queries)))
+
+        if connect:
+            try:
+                player = cast(MusicPlayer, await connect)
+            except discord.ClientException:
+                # Something else joined voice while the search ran
+                player = cast(MusicPlayer, guild.voice_client)
+            except (pomice.exceptions.NodeNotAvailable, pomice.exceptions.NoNodesAvailable, asyncio.TimeoutError):
+                return await self._reject(accepted, UNAVAILABLE, 10)
+
+            if not player:
+                return
+
+        handled = []
+        for message, queries in requests:
+            missing = []
+            failed = []
+            capped = 0
+            for query in queries:
+                tracks = next(results)
+                if isinstance(tracks, Exception):
+                    failed.append(query)
+                    continue
+                if not tracks:
+                    missing.append(query)
+                    continue
+
+                tracks = tracks.tracks if isinstance(tracks, pomice.objects.Playlist) else tracks[:1]
+                added = governor.fit(player, tracks)
+                capped += len(tracks) - len(added)
+                for track in added:
+                    track.requester = message.author
+                player.queue.extend(added)
+
+            if capped:
+                msg = await message.channel.send(
+                    f"{capped} song(s) were not added. Playlists are limited to {governor.max_playlist} songs "
+                    f"and the queue to {governor.max_queue}."
+                )
+                self.bot.deletions.schedule(msg.delete, 10)
+
+            if len(failed) == len(queries):
+                msg = await message.channel.send(UNAVAILABLE)
+                self.bot.deletions.schedule(msg.delete, 10)
+                continue
+            if failed:
+                msg = await message.channel.send(f"Searching failed for: {', '.join(failed)}. Please try them again shortly.")
+                self.bot.deletions.schedule(msg.delete, 10)
+
+            if len(missing) == len(queries):
+                msg = await message.channel.send(f"No matching tracks were found. Please refine your search and try again.")
+                self.bot.deletions.schedule(msg.delete, 5)
+                continue
+            if missing:
+                msg = await message.channel.send(f"No matching tracks were found for: {', '.join(missing)}")
+                self.bot.deletions.schedule(msg.delete, 5)
+            if len(missing) + len(failed) == len(queries):
+                continue
+            handled.append(message)
+
+        if not handled:
             return
-        
-        if isinstance(tracks, pomice.objects.Playlist):
-            for track in tracks.tracks:
-                track.requester = message.author
-            player.queue.extend(tracks.tracks)
-        else:
-            track: Track = tracks[0]
-            track.requester = message.author
-            player.queue.put(track)
 
-        if not player.is_playing:
+        if not player.is_playing and not player.queue.is_empty:
             song = player.queue.get()
             await player.play(song)
 
-        await player.update_queue(self.db)
-        await message.delete()
+        await player.update_queue(self.guilds)
+        try:
+            await handled[0].channel.delete_messages(handled)
+        except discord.HTTPException:
+            pass
+
+    async def _reject(self, messages: List[discord.Message], reason: str, delay: float) -> None:
+        msg = await messages[0].channel.send(reason)
+        self.bot.deletions.schedule(msg.delete, delay)
+        try:
+            await messages[0].channel.delete_messages(messages)
+        except discord.HTTPException:
+            pass
+
+    async def _accept(self, message: discord.Message) -> bool:
+        """ Check the author can request songs and apply the channel lock, replying when refused """
+        state = self.guilds.get(message.guild.id)
+        if not state:
+            return False
+
+        player = cast(MusicPlayer, message.guild.voice_client)
+        if not player and not message.author.voice:
+            msg = await message.channel.send('Please join a voice channel to use music features.')
+            self.bot.deletions.schedule(msg.delete, 5)
+            await message.delete()
+            return False
+
+        if state.locked:
+            if player and player.is_playing:
+                msg = await message.channel.send("The music channel is locked. Adding new songs is temporarily disabled.")
+                self.bot.deletions.schedule(msg.delete, 5)
+                await message.delete()
+                return False
+            await self.guilds.set_locked(message.guild.id, False)
+
+        return True
 
     @commands.Cog.listener()
     async def on_ready(self):
-        if not self.db.music:
+        # on_ready fires again after every gateway reconnect, recovery only needs to run once
+        if self._recovered or not self.db.music:
+            return
+        self._recovered = True
+
+        await self.recover_channels()
+        await self.restore_players()
+
+    async def recover_channels(self) -> None:
+        """ Reset every registered music channel to its idle messages, repairing the ones that went missing """
+        await self.guilds.load()
+
+        embed, embed2 = default_embed(self.bot)
+        semaphore = asyncio.Semaphore(RECOVERY_CONCURRENCY)
+
+        async def recover(state: 'GuildState'):
+            async with semaphore:
+                try:
+                    await self._recover_channel(state, embed, embed2)
+                except discord.HTTPException as e:
+                    log.warning(f"Failed to recover the music channel of guild {state.guild_id}: {e}")
+
+        await asyncio.gather(*(recover(state) for state in self.guilds.values()))
+
+    async def _recover_channel(self, state: 'GuildState', embed: discord.Embed, embed2: discord.Embed) -> None:
+        guild = self.bot.get_guild(state.guild_id)
+        if not guild:
             return
 
-        for guild in self.bot.guilds:
-            for channel in guild.text_channels:
-                if "2296-song-request" in channel.name.lower():
-                    exists = await self.db.fetchone("SELECT * FROM music WHERE guild_id = %s", guild.id)
-                    if exists:
-                        self.channels.append(channel.id)
-                        continue
-
-                    try:
-                        messages = [msg async for msg in channel.history() if msg.author == self.bot.user]
-                    except Exception as e:
-                        continue
-
-                    if len(messages) < 2:
-                        continue
-
-                    song_msg = messages[0]
-                    queue_msg = messages[1]
-
-                    embed, embed2 = default_embed(self.bot)
-                    disabled_buttons(self.view.children)
-
-                    try:
-                        await song_msg.edit(embed=embed, view=self.view)
-                        await queue_msg.edit(embed=embed2)
-                    except Exception as e:
-                        print(f"Failed to edit recovered messages: {e}")
-                        continue
-
-                    await self.db.execute(
-                        "INSERT INTO music (guild_id, channel_id, message_id, queue_id) VALUES (%s, %s, %s, %s)",
-                        guild.id, channel.id, song_msg.id, queue_msg.id
-                    )
-                    self.channels.append(channel.id)
+        channel = guild.get_channel(state.channel_id)
+        if not channel:
+            return await self.guilds.remove(guild.id)
+
+        if state.message_id and state.queue_id:
+            try:
+                apply_controls(self.view, guild, self.guilds)
+                await channel.get_partial_message(state.message_id).edit(embed=embed, view=self.view)
+                await channel.get_partial_message(state.queue_id).edit(embed=embed2)
+                return
+            except discord.NotFound:
+                pass
+
+        # The stored messages are gone, look for the latest ones before sending new
+        messages = [msg async for msg in channel.history(limit=RECOVERY_HISTORY) if msg.author == self.bot.user]
+        if len(messages) >= 2:
+            song_msg, queue_msg = messages[0], messages[1]
+            apply_controls(self.view, guild, self.guilds)
+            await song_msg.edit(embed=embed, view=self.view)
+            await queue_msg.edit(embed=embed2)
+        else:
+            queue_msg = await channel.send(embed=embed2)
+            apply_controls(self.view, guild, self.guilds)
+            song_msg = await channel.send(embed=embed, view=self.view)
+
+        await self.guilds.save(guild.id, channel.id, song_msg.id, queue_msg.id)
+
+    async def restore_players(self) -> None:
+        """ Reattach the players that were running when the bot last shut down """
+        await self.bot.nodes_ready.wait()
+
+        for snapshot in await load_players(self.db):
+            try:
+                restored = await self._restore_player(snapshot)
+            except Exception as e:
+                # Most likely no node or voice yet, keep the row so the next start can try again
+                log.warning(f"Failed to restore the player in guild {snapshot.guild_id}: {e}")
+                continue
+
+            # Restored players keep their rows up to date through the queue store
+            if not restored:
+                await delete_player(self.db, snapshot.guild_id)
+
+        for node in self.bot.pomice.nodes.values():
+            if getattr(node, 'resumed', False) and is_node_up(node):
+                try:
+                    await discard_orphans(node)
+                except pomice.PomiceException as e:
+                    log.warning(f"Failed to clean up resumed players on {node._identifier}: {e}")
+
+    async def _restore_player(self, snapshot: 'AttrDict') -> bool:
+        """ Returns False when the snapshot is no longer worth keeping, raises when the restore should be retried """
+        guild = self.bot.get_guild(snapshot.guild_id)
+        channel = guild.get_channel(snapshot.voice_channel_id) if guild else None
+        if not channel or guild.voice_client:
+            return False
+
+        # Nobody is left to listen, and an empty channel never triggers the leave logic
+        if not any(not member.bot for member in channel.members):
+            return False
+
+        # Rejoin the node that still holds the session, or whichever is least loaded if it is gone
+        node = self.bot.pomice.nodes.get(snapshot.node_id)
+        node = node if node and is_node_up(node) else None
+
+        player = await channel.connect(cls=functools.partial(MusicPlayer, node=node))
+        player = cast(MusicPlayer, player)
+        try:
+            await player.restore(snapshot, await load_queue(self.db, guild.id))
+        except Exception:
+            # Leave voice and keep the stored row as it was for the next attempt
+            self.guilds.queues.discard(guild.id)
+            with contextlib.suppress(Exception):
+                await player.destroy()
+            raise
+
+        if player.current:
+            await player.now_playing(self.guilds, self.view)
+        await player.update_queue(self.guilds)
+        log.info(f"Restored the player in guild {guild.id} on {player.node._identifier}.")
+        return True
+
+    async def save_players(self) -> None:
+        """ Snapshot every player so the next start can resume them """
+        for node in self.bot.pomice.nodes.values():
+            for player in list(node.players.values()):
+                if isinstance(player, MusicPlayer) and player.channel:
+                    self.guilds.queues.mark_dirty(player.guild.id, player.snapshot)
+
+        await self.guilds.queues.flush_all()
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before, after):
@@ -228,7 +582,7 @@ class Music(commands.Cog, name='music', description='Play, Skip, Seek and more u
         if member.id == self.bot.user.id:
             if before.channel and not after.channel:
                 if player:
-                    await reset_embeds(player, self.db, self.view)
+                    await reset_embeds(self, player)
                 return
 
         if not player or not player.channel:
@@ -241,18 +595,15 @@ class Music(commands.Cog, name='music', description='Play, Skip, Seek and more u
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
-        if channel.id not in self.channels:
+        if channel.id not in self.guilds:
             return
 
-        await self.db.execute(
-            "DELETE FROM music WHERE channel_id = %s AND guild_id = %s",
-            channel.id, channel.guild.id
-        )
+        await self.guilds.remove(channel.guild.id)
 
         if isinstance(channel, discord.VoiceChannel):
             player = self.bot.pomice.get_best_node().get_player(channel.guild.id)
             if player and player.channel and player.channel.id == channel.id:
-                await reset_embeds(player)
+                await reset_embeds(self, player)
 
 
 
@@ -1,32 +1,989 @@
+import asyncio
+import bisect
+import contextlib
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+import functools
 import json
+import logging
 import os
+import random
+import re
+import time
 from urllib.parse import quote
 from discord import Interaction
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, List, Optional, Union
 
+import aiohttp
 import discord
-from pomice import LoopMode, Player, Playlist, PlaylistType, Queue, Track, TrackType
+from pomice import LoopMode, Player, Playlist, PlaylistType, SearchType, Track, TrackType
 import pomice
 from pomice.spotify.client import Client
 
+from bot.cogs.utils.music_store import QueueStore, encoded_track
+from bot.cogs.utils.queue import CompactQueue
+from bot.utils.cache import MISSING, SizedLRUCache, TTLCache
+from bot.utils.lavalink import best_node
+
 if TYPE_CHECKING:
     from bot.cogs.music import MusicPlayer
     from bot.utils.database import Database
+    from bot.utils.types import AttrDict
+
+log = logging.getLogger(__name__)
+
+HISTORY_SIZE = 25
+AUTOPLAY_LOW_WATER = int(os.getenv("AUTOPLAY_LOW_WATER", 2))
+LYRICS_CACHE_BYTES = 8 * 1024 * 1024  # 8 MiB
+SEARCH_CACHE_TRACKS = 50_000  # tracks held across every cached search and playlist result
+INGEST_INBOX = int(os.getenv("INGEST_INBOX", 20))
+INGEST_CONCURRENCY = 3
+MAX_REQUEST_LINES = 10
+SEARCH_SOURCES = (SearchType.ytmsearch, SearchType.ytsearch, SearchType.scsearch)
+SEARCH_RACE = os.getenv("SEARCH_RACE", "0") == "1"
+SEARCH_TIMEOUT = 5.0
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 8))
+SEARCH_BACKLOG = int(os.getenv("SEARCH_BACKLOG", 50))
+MAX_QUEUE_LENGTH = int(os.getenv("MAX_QUEUE_LENGTH", 500))
+MAX_PLAYLIST_SIZE = int(os.getenv("MAX_PLAYLIST_SIZE", 200))
+LIVE_DEFAULT = os.getenv("LIVE_NOW_PLAYING", "0") == "1"
+LIVE_EDIT_RATE = float(os.getenv("LIVE_EDIT_RATE", 5))  # live edits per second, shared by every guild
+LIVE_MIN_INTERVAL = 3.0
+LIVE_SLOW_EDIT = 1.0
+PROGRESS_WIDTH = 14
+PAUSE_EMOJI = '<:Pause:1158995866221281331>'
+RESUME_EMOJI = '<:Resume:1158995889591955466>'
+LOCK_EMOJI = '<:Lock:1158995859992744008>'
+UNLOCK_EMOJI = '<:Unlock:1158995915508564008>'
+UNAVAILABLE = 'The music service is currently unavailable. Please try again shortly.'
+SPOTIFY_TOKEN_URL = 'http://spotify-tokener:8080/api/token'
+SPOTIFY_URL = re.compile(r'https?://open.spotify.com/(?P<type>album|playlist|track|artist)/(?P<id>[a-zA-Z0-9]+)')
+YOUTUBE_ID = re.compile(r'^[\w-]{11}$')
+
+
+class RenderScheduler:
+    """ Debounces message renders for one guild, so a burst of changes becomes one edit of the latest state """
+
+    def __init__(self, delay: float = 0.75, interval: float = 1.0):
+        self.delay = delay
+        self.base_interval = interval
+        self.interval = interval
+        self.requested = 0
+        self.coalesced = 0
+        self.renders = 0
+        self._pending: Dict[str, Callable[[], Awaitable]] = {}
+        self._last_render: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, kind: str, render: Callable[[], Awaitable]) -> None:
+        self.requested += 1
+        if kind in self._pending:
+            self.coalesced += 1
+        self._pending[kind] = render
+
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def cancel(self) -> None:
+        self._pending.clear()
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            await asyncio.sleep(self.delay)
+
+            for kind in list(self._pending):
+                wait = self._last_render.get(kind, 0) + self.interval - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                render = self._pending.pop(kind, None)
+                if not render:
+                    continue
+
+                try:
+                    await render()
+                except discord.HTTPException as e:
+                    if e.status == 429:
+                        self._pending.setdefault(kind, render)
+                        self.interval = min(self.interval * 2, 10)
+                    else:
+                        log.warning(f"Failed to render {kind} message: {e}")
+                    continue
+                except Exception:
+                    log.exception(f"Failed to render {kind} message")
+
+                # Recover from a 429 backoff once edits go through again
+                self.interval = max(self.interval / 2, self.base_interval)
+                self.renders += 1
+                self._last_render[kind] = loop.time()
+
+    def is_pending(self, kind: str) -> bool:
+        return kind in self._pending
+
+
+class EditBudget:
+    """ Spacing between live edits of one guild's controller, stretched by 429s and slow edits """
+
+    def __init__(self, max_penalty: float = 8.0):
+        self.max_penalty = max_penalty
+        self.penalty = 1.0
+        self.last = 0.0
+        self.limited = 0
+
+    def due(self, now: float, interval: float) -> bool:
+        return now - self.last >= interval * self.penalty
+
+    def record(self, latency: float) -> None:
+        # discord.py waits out rate limits before returning, so a slow edit usually means the bucket ran dry
+        if latency > LIVE_SLOW_EDIT:
+            self.penalty = min(self.penalty * 1.5, self.max_penalty)
+        else:
+            self.penalty = max(self.penalty * 0.9, 1.0)
+
+    def rate_limited(self) -> None:
+        self.limited += 1
+        self.penalty = min(self.penalty * 2, self.max_penalty)
+
+
+class IngestWorker:
+    """ Bounded inbox of a guild's song requests, handed to `handle` in arrival order one batch at a time """
+
+    def __init__(self, handle: Callable[[List[discord.Message]], Awaitable], maxsize: int = INGEST_INBOX):
+        self.handle = handle
+        self.inbox: 'asyncio.Queue[discord.Message]' = asyncio.Queue(maxsize)
+        self.limit = asyncio.Semaphore(INGEST_CONCURRENCY)
+        self.rejected = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, message: discord.Message) -> bool:
+        """ Queue a request, returns False when the inbox is full """
+        try:
+            self.inbox.put_nowait(message)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self) -> None:
+        while not self.inbox.empty():
+            batch = [self.inbox.get_nowait() for _ in range(self.inbox.qsize())]
+            try:
+                await self.handle(batch)
+            except Exception:
+                log.exception(f"Failed to handle {len(batch)} song request(s)")
+
+
+@dataclass
+class GuildState:
+    guild_id: int
+    channel_id: int
+    message_id: Optional[int] = None
+    queue_id: Optional[int] = None
+    locked: bool = False
+    live: bool = LIVE_DEFAULT
+    handles: Dict[str, discord.PartialMessage] = field(default_factory=dict, repr=False)
+    signatures: Dict[str, tuple] = field(default_factory=dict, repr=False)
+    renderer: RenderScheduler = field(default_factory=RenderScheduler, repr=False)
+    budget: EditBudget = field(default_factory=EditBudget, repr=False)
+    history: Deque[Track] = field(default_factory=lambda: deque(maxlen=HISTORY_SIZE), repr=False)
+
+    def message_ids(self) -> Dict[str, Optional[int]]:
+        return {'controller': self.message_id, 'queue': self.queue_id}
+
+
+class GuildRegistry:
+    """ In-memory copy of the `music` table, written through on every change """
+
+    def __init__(self, db: 'Database'):
+        self.db = db
+        self.queues = QueueStore(db)
+        self._guilds: Dict[int, GuildState] = {}
+        self._channels: Dict[int, int] = {}
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self._channels
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    def get(self, guild_id: int) -> Optional[GuildState]:
+        return self._guilds.get(guild_id)
+
+    def values(self) -> List[GuildState]:
+        return list(self._guilds.values())
+
+    def by_channel(self, channel_id: int) -> Optional[GuildState]:
+        guild_id = self._channels.get(channel_id)
+        return self._guilds.get(guild_id) if guild_id else None
+
+    def _cache(self, state: GuildState) -> GuildState:
+        self._guilds[state.guild_id] = state
+        self._channels[state.channel_id] = state.guild_id
+        return state
+
+    async def load(self) -> None:
+        rows = await self.db.fetchall("SELECT * FROM music")
+        self._guilds.clear()
+        self._channels.clear()
+
+        for row in rows:
+            self._cache(GuildState(
+                guild_id=row['guild_id'],
+                channel_id=row['channel_id'],
+                message_id=row['message_id'],
+                queue_id=row['queue_id'],
+                locked=bool(row['locked']),
+            ))
+
+    async def save(self, guild_id: int, channel_id: int, message_id: int, queue_id: int) -> GuildState:
+        await self.db.execute(
+            "INSERT INTO music (guild_id, channel_id, message_id, queue_id) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE channel_id = VALUES(channel_id), message_id = VALUES(message_id), "
+            "queue_id = VALUES(queue_id)",
+            guild_id, channel_id, message_id, queue_id
+        )
+        state = self._guilds.get(guild_id)
+        if not state:
+            return self._cache(GuildState(guild_id, channel_id, message_id, queue_id))
+
+        self._channels.pop(state.channel_id, None)
+        state.channel_id, state.message_id, state.queue_id = channel_id, message_id, queue_id
+        state.handles.clear()
+        state.signatures.clear()
+        return self._cache(state)
+
+    async def set_locked(self, guild_id: int, locked: bool) -> None:
+        state = self._guilds.get(guild_id)
+        if not state or state.locked == locked:
+            return
+
+        await self.db.execute("UPDATE music SET locked = %s WHERE guild_id = %s", locked, guild_id)
+        state.locked = locked
+
+    async def remove(self, guild_id: int) -> None:
+        state = self._guilds.pop(guild_id, None)
+        if not state:
+            return
+
+        self._channels.pop(state.channel_id, None)
+        state.renderer.cancel()
+        await self.db.execute(
+            "DELETE FROM music WHERE channel_id = %s AND guild_id = %s",
+            state.channel_id, guild_id
+        )
+
+    def schedule(self, guild: discord.Guild, kind: str, render: Callable[[], Awaitable]) -> None:
+        state = self._guilds.get(guild.id)
+        if state:
+            state.renderer.schedule(kind, render)
+
+    def render_stats(self) -> Dict[str, int]:
+        renderers = [state.renderer for state in self._guilds.values()]
+        return {
+            'requested': sum(r.requested for r in renderers),
+            'coalesced': sum(r.coalesced for r in renderers),
+            'renders': sum(r.renders for r in renderers),
+        }
+
+    def _handle(self, guild: discord.Guild, state: GuildState, kind: str) -> Optional[discord.PartialMessage]:
+        message_id = state.message_ids()[kind]
+        handle = state.handles.get(kind)
+        if handle and handle.id == message_id:
+            return handle
+
+        channel = guild.get_channel(state.channel_id)
+        if not channel or not message_id:
+            return None
+
+        handle = state.handles[kind] = channel.get_partial_message(message_id)
+        return handle
+
+    async def edit(self, guild: discord.Guild, kind: str, force: bool = False, **kwargs) -> Optional[discord.Message]:
+        """ Edit the `controller` or `queue` message through a cached handle, without fetching it first """
+        state = self._guilds.get(guild.id)
+        if not state:
+            return None
+
+        embed, view = kwargs.get('embed'), kwargs.get('view')
+        signature = (
+            (embed.title, embed.description) if embed else None,
+            tuple((c.custom_id, c.disabled, str(c.emoji)) for c in view.children) if view else None,
+        )
+        if not force and state.signatures.get(kind) == signature:
+            return None
+
+        handle = self._handle(guild, state, kind)
+        if not handle:
+            return None
+
+        try:
+            message = await handle.edit(**kwargs)
+        except discord.NotFound:
+            message = await self._recreate(guild, state, kind, **kwargs)
+        except discord.DiscordServerError:
+            return None
+
+        if message:
+            state.signatures[kind] = signature
+        return message
+
+    async def _recreate(self, guild: discord.Guild, state: GuildState, kind: str, **kwargs) -> Optional[discord.Message]:
+        channel = guild.get_channel(state.channel_id)
+        if not channel:
+            await self.remove(guild.id)
+            return None
+
+        try:
+            message = await channel.send(**kwargs)
+        except discord.HTTPException:
+            return None
+
+        ids = state.message_ids()
+        ids[kind] = message.id
+        await self.save(guild.id, state.channel_id, ids['controller'], ids['queue'])
+        state.handles[kind] = channel.get_partial_message(message.id)
+        return message
+
+
+class LiveTicker:
+    """
+    Refreshes the controller of guilds in live mode with a progress bar and the current synced lyric line.
+    Every live guild shares LIVE_EDIT_RATE, a frame is dropped while the previous one is still waiting to render.
+    """
+
+    def __init__(self, bot: discord.Client, guilds: GuildRegistry, view, tick: float = 1.0, rate: float = LIVE_EDIT_RATE):
+        self.bot = bot
+        self.guilds = guilds
+        self.view = view
+        self.tick = tick
+        self.rate = rate
+        self.frames = 0
+        self.dropped = 0
+        self.live = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    def interval(self) -> float:
+        return max(LIVE_MIN_INTERVAL, self.live / self.rate)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self.check()
+            except Exception:
+                log.exception("Live now playing tick failed")
+
+    def check(self) -> None:
+        players = []
+        for state in self.guilds.values():
+            guild = self.bot.get_guild(state.guild_id) if state.live else None
+            player = guild.voice_client if guild else None
+            if isinstance(player, MusicPlayer) and player.current and player.is_playing and not player.is_paused:
+                players.append((guild, state, player))
+
+        self.live = len(players)
+        interval = self.interval()
+        now = time.monotonic()
+
+        for guild, state, player in players:
+            if not state.budget.due(now, interval):
+                continue
+            if state.renderer.is_pending('controller'):
+                # The queued frame reads the position when it renders, a second one would only build a backlog
+                self.dropped += 1
+                continue
+
+            state.budget.last = now
+            self.frames += 1
+            self.guilds.schedule(guild, 'controller', functools.partial(self._frame, state, player))
+
+    async def _frame(self, state: GuildState, player: 'MusicPlayer') -> None:
+        start = time.perf_counter()
+        try:
+            await player._render_controller(self.guilds, self.view)
+        except discord.HTTPException as e:
+            if e.status != 429:
+                raise
+            state.budget.rate_limited()
+            self.dropped += 1
+            return
+
+        state.budget.record(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'live': self.live,
+            'interval': self.interval(),
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'limited': sum(state.budget.limited for state in self.guilds.values()),
+        }
+
+
+def result_size(result: Union[List[Track], Playlist, None]) -> int:
+    """ Tracks held by a cached load result, a miss still counts as one entry """
+    if isinstance(result, Playlist):
+        return max(len(result.tracks), 1)
+    return max(len(result or ()), 1)
+
+
+class TrackResolver:
+    """ Process-wide cache in front of Lavalink track loading, shared by every guild """
+
+    def __init__(self, negative_ttl: float = 60.0):
+        # A playlist result can hold thousands of tracks, so the caches are bounded by tracks as well as entries
+        self.searches = TTLCache(maxsize=4096, ttl=6 * 3600, maxweight=SEARCH_CACHE_TRACKS, weigh=result_size)
+        self.spotify = TTLCache(maxsize=1024, ttl=3600, maxweight=SEARCH_CACHE_TRACKS // 5, weigh=result_size)
+        self.negative_ttl = negative_ttl
+
+    @staticmethod
+    def cache_key(query: str, search_type: Optional[SearchType]) -> tuple:
+        query = query.strip()
+        if spotify := SPOTIFY_URL.match(query):
+            return 'spotify', None, f"{spotify['type']}/{spotify['id']}"
+        if query.startswith(('http://', 'https://')):
+            return 'url', None, query
+        return 'search', search_type.value if search_type else None, ' '.join(query.lower().split())
+
+    async def resolve(
+        self, node: pomice.Node, query: str, search_type: Optional[SearchType] = SearchType.ytmsearch
+    ) -> Union[List[Track], Playlist, None]:
+        query = query.strip()
+        if SPOTIFY_URL.match(query):
+            search_type = None
+
+        key = self.cache_key(query, search_type)
+        cache = self.spotify if key[0] == 'spotify' else self.searches
+
+        result = cache.get(key)
+        if result is MISSING:
+            result = await node.get_tracks(query, search_type=search_type)
+            cache.set(key, result, ttl=None if result else self.negative_ttl)
+
+        return copy_result(result)
+
+    def stats(self) -> Dict[str, dict]:
+        return {'searches': self.searches.stats(), 'spotify': self.spotify.stats()}
+
+
+def percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class SourceStats:
+    """ Success rate (EWMA) and latency window of one search source """
+
+    def __init__(self, alpha: float = 0.1, window: int = 100):
+        self.alpha = alpha
+        self.success = 1.0
+        self.requests = 0
+        self.failures = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    def record(self, ok: bool, latency: float) -> None:
+        self.requests += 1
+        self.failures += not ok
+        self.success += self.alpha * (ok - self.success)
+        self.latencies.append(latency)
+
+    def censored(self, latency: float) -> None:
+        """ A search cancelled after `latency`, the source would have taken at least that long """
+        self.latencies.append(latency)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return percentile(self.latencies, 0.95)
+
+
+class SearchFailed(Exception):
+    """ Every search source errored, as opposed to finding nothing """
+
+
+class SearchStrategy:
+    """
+    Resolves free-text queries across several search sources, in the order of their recent success rate and p95 latency.
+    Either races the two best sources and keeps the first non-empty result, or falls back one source at a time.
+    """
+
+    def __init__(self, resolver: TrackResolver, sources=SEARCH_SOURCES, race: bool = SEARCH_RACE):
+        self.resolver = resolver
+        self.sources = list(sources)
+        self.race = race
+        self.stats: Dict[SearchType, SourceStats] = {source: SourceStats() for source in self.sources}
+
+    def score(self, source: SearchType) -> float:
+        # Unmeasured sources assume a one second p95, later sources need to be clearly better to move up
+        stats = self.stats[source]
+        p95 = stats.p95 if stats.p95 is not None else 1.0
+        return p95 / max(stats.success, 0.05) * (1 + 0.5 * self.sources.index(source))
+
+    def order(self) -> List[SearchType]:
+        return sorted(self.sources, key=self.score)
+
+    async def resolve(self, node: pomice.Node, query: str) -> Union[List[Track], Playlist, None]:
+        query = query.strip()
+        if SPOTIFY_URL.match(query) or query.startswith(('http://', 'https://')):
+            return await self.resolver.resolve(node, query)
+
+        key = self.resolver.cache_key(query, None)
+        result = self.resolver.searches.get(key)
+        if result is MISSING:
+            sources = self.order()
+            result, answered, failed = await (
+                self._race(node, query, sources) if self.race else self._fallback(node, query, sources)
+            )
+            if not result and not answered:
+                raise SearchFailed(f"Every search source failed for {query!r}")
+
+            # "No match" is only cached when every source that was asked actually answered
+            if result or not failed:
+                self.resolver.searches.set(key, result, ttl=None if result else self.resolver.negative_ttl)
+
+        return copy_result(result)
+
+    async def _race(self, node: pomice.Node, query: str, sources: List[SearchType]):
+        tasks = [asyncio.create_task(self._search(node, query, source)) for source in sources[:2]]
+        answered = failed = 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                result, ok = await task
+                answered += ok
+                failed += not ok
+                if result:
+                    return result, answered, failed
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        result, more_answered, more_failed = await self._fallback(node, query, sources[2:])
+        return result, answered + more_answered, failed + more_failed
+
+    async def _fallback(self, node: pomice.Node, query: str, sources: List[SearchType]):
+        answered = failed = 0
+        for source in sources:
+            result, ok = await self._search(node, query, source)
+            answered += ok
+            failed += not ok
+            if result:
+                return result, answered, failed
+        return None, answered, failed
+
+    async def _search(self, node: pomice.Node, query: str, source: SearchType):
+        """ The source's result and whether it answered at all, errors and timeouts are not an empty result """
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(node.get_tracks(query, search_type=source), timeout=SEARCH_TIMEOUT)
+        except (asyncio.TimeoutError, aiohttp.ClientError, pomice.PomiceException) as e:
+            log.warning(f"{source.value} search for {query!r} failed: {e!r}")
+            self.stats[source].record(False, time.perf_counter() - start)
+            return None, False
+        except asyncio.CancelledError:
+            # Lost a race, the latency still tells the ranking this source is slower
+            self.stats[source].censored(time.perf_counter() - start)
+            raise
+
+        self.stats[source].record(bool(result), time.perf_counter() - start)
+        return result, True
+
+    def source_stats(self) -> Dict[str, dict]:
+        return {
+            source.value: {
+                'requests': stats.requests,
+                'failures': stats.failures,
+                'success': stats.success,
+                'p95': stats.p95,
+                'score': self.score(source),
+            }
+            for source, stats in self.stats.items()
+        }
+
+
+class SearchGovernor:
+    """
+    Caps the searches in flight across every guild, handing free slots to waiting guilds in turn
+    so one busy server cannot starve the rest. Also owns the queue length and playlist import limits.
+    """
+
+    def __init__(
+        self, capacity: int = SEARCH_CONCURRENCY, backlog: int = SEARCH_BACKLOG,
+        max_queue: int = MAX_QUEUE_LENGTH, max_playlist: int = MAX_PLAYLIST_SIZE
+    ):
+        self.capacity = capacity
+        self.backlog = backlog
+        self.max_queue = max_queue
+        self.max_playlist = max_playlist
+        self.in_flight = 0
+        self.throttled = 0
+        self.capped = 0
+        self._active: Dict[int, int] = {}
+        self._waiting: 'OrderedDict[int, Deque[asyncio.Future]]' = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def fair_share(self) -> int:
+        """ How many searches one guild may have in flight or waiting while others compete for the backlog """
+        guilds = len(self._active.keys() | self._waiting.keys()) + 1
+        return max(MAX_REQUEST_LINES, self.backlog // guilds)
+
+    def admit(self, guild_id: int, searches: int, reserved: int = 0) -> bool:
+        """
+        Whether a guild may start `searches` more searches on top of `reserved` ones it was already admitted for
+        but has not started yet, counts the request as throttled when not
+        """
+        pending = self._active.get(guild_id, 0) + len(self._waiting.get(guild_id, ())) + reserved
+        if self.waiting + reserved + searches > self.backlog or pending + searches > self.fair_share():
+            self.throttled += 1
+            return False
+        return True
+
+    @contextlib.asynccontextmanager
+    async def slot(self, guild_id: int):
+        await self._acquire(guild_id)
+        try:
+            yield
+        finally:
+            self._release(guild_id)
+
+    async def _acquire(self, guild_id: int) -> None:
+        if self.in_flight < self.capacity and not self._waiting:
+            return self._take(guild_id)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(guild_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation
+                self._release(guild_id)
+            elif future in self._waiting.get(guild_id, ()):
+                self._waiting[guild_id].remove(future)
+                if not self._waiting[guild_id]:
+                    del self._waiting[guild_id]
+            raise
+
+    def _take(self, guild_id: int) -> None:
+        self.in_flight += 1
+        self._active[guild_id] = self._active.get(guild_id, 0) + 1
+
+    def _release(self, guild_id: int) -> None:
+        self.in_flight -= 1
+        self._active[guild_id] -= 1
+        if not self._active[guild_id]:
+            del self._active[guild_id]
+
+        # Round robin over the waiting guilds, each gets one slot before any guild gets a second
+        while self._waiting and self.in_flight < self.capacity:
+            waiting_id, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(waiting_id)
+            else:
+                del self._waiting[waiting_id]
+
+            if not future.done():
+                self._take(waiting_id)
+                future.set_result(None)
+
+    def fit(self, player: 'MusicPlayer', tracks: list) -> list:
+        """ The part of `tracks` that fits the player's queue and the playlist import limit """
+        room = max(self.max_queue - player.queue.count, 0)
+        allowed = tracks[:min(room, self.max_playlist)]
+        self.capped += len(tracks) - len(allowed)
+        return allowed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': self.in_flight,
+            'capacity': self.capacity,
+            'waiting': self.waiting,
+            'throttled': self.throttled,
+            'capped': self.capped,
+        }
+
+
+class SpotifyToken:
+    """ One Spotify access token for every player, refreshed shortly before it expires """
+
+    def __init__(self, url: str = SPOTIFY_TOKEN_URL, margin: float = 60.0):
+        self.url = url
+        self.margin = margin
+        self.requests = 0
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._used = False
+        self._refreshing: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def valid(self) -> bool:
+        return bool(self._token) and time.time() < self._expires_at - self.margin
+
+    async def get(self, session: aiohttp.ClientSession) -> Optional[str]:
+        self._used = True
+        if self.valid:
+            return self._token
+        return await asyncio.shield(self._refresh(session))
+
+    def _refresh(self, session: aiohttp.ClientSession) -> asyncio.Task:
+        if not self._refreshing or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._fetch(session))
+        return self._refreshing
+
+    async def _fetch(self, session: aiohttp.ClientSession) -> Optional[str]:
+        self.requests += 1
+        try:
+            async with session.get(self.url) as resp:
+                data: dict = await resp.json(loads=json.loads)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            log.warning(f"Failed to fetch Spotify token: {e}")
+            return None
+
+        self._token = data.get('accessToken')
+        self._expires_at = data.get('accessTokenExpirationTimestampMs', 0) / 1000
+        self._used = False
+
+        if self._timer:
+            self._timer.cancel()
+        delay = max(self._expires_at - self.margin - time.time(), 5)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._refresh_if_used, session)
+        return self._token
+
+    def _refresh_if_used(self, session: aiohttp.ClientSession) -> None:
+        if self._used and not session.closed:
+            self._refresh(session)
+
+
+resolver = TrackResolver()
+search = SearchStrategy(resolver)
+governor = SearchGovernor()
+spotify_token = SpotifyToken()
+recommendations = TTLCache(maxsize=512, ttl=30 * 60, maxweight=SEARCH_CACHE_TRACKS // 5, weigh=result_size)
+transitions: Deque[float] = deque(maxlen=500)
+
+
+def lyrics_size(lines: list) -> int:
+    return 64 + sum(len(line.get('line', '').encode()) + 64 for line in lines)
+
+lyrics = SizedLRUCache(maxbytes=LYRICS_CACHE_BYTES, sizeof=lyrics_size)
+
+
+def request_queries(content: str) -> List[str]:
+    """ Every non-empty line of a song request is its own query """
+    queries = [line.strip() for line in content.splitlines()]
+    return [query for query in queries if query][:MAX_REQUEST_LINES]
+
+
+def copy_track(track: Track) -> Track:
+    return Track(
+        track_id=track.track_id,
+        info=dict(track.info),
+        ctx=track.ctx,
+        track_type=track.track_type,
+        search_type=track._search_type,
+        filters=track.filters,
+        timestamp=track.timestamp,
+    )
+
+def copy_result(result: Union[List[Track], Playlist, None]) -> Union[List[Track], Playlist, None]:
+    """ Cached results are shared, so every caller gets its own Track objects to set requesters on """
+    if not result:
+        return result
+
+    if isinstance(result, Playlist):
+        return Playlist(
+            playlist_info=result.playlist_info,
+            tracks=[copy_track(track) for track in result.tracks],
+            playlist_type=result.playlist_type,
+            thumbnail=result.thumbnail,
+            uri=result.uri,
+        )
+
+    return [copy_track(track) for track in result]
+
 
 class MusicPlayer(Player):
     def __init__(self, *args, **kwargs):
+        if not kwargs.get('node'):
+            kwargs['node'] = best_node()
         super().__init__(*args, **kwargs)
         self.autoplay = False
-        self.queue = Queue()
+        self.autoplay_buffer: List[Track] = []
+        self.queue = CompactQueue(self.guild)
         self.color = 0x7F00FF
-        self.last_lyrics = {}
+        self._prefetch: Optional[asyncio.Task] = None
+        self._lyrics: Optional[asyncio.Task] = None
+        self._lyrics_track: Optional[str] = None
+        self._synced: Optional[tuple[str, List[int], list]] = None
+        self._track_ended: Optional[float] = None
+
+    def track_ended(self) -> None:
+        self._track_ended = time.perf_counter()
+
+    def track_started(self) -> None:
+        """ Record how long the gap between the previous track ending and this one starting was """
+        if self._track_ended is None:
+            return
+
+        elapsed = time.perf_counter() - self._track_ended
+        self._track_ended = None
+        transitions.append(elapsed)
+        log.debug(f"[Metrics] track_transition_seconds guild={self.guild.id} value={elapsed:.3f}")
+
+    def prefetch_recommendations(self, guilds: GuildRegistry) -> None:
+        """ Start loading autoplay tracks once the queue drops below the low-water mark """
+        if not self.autoplay or self.queue.loop_mode or not self.current:
+            return
+        if self.autoplay_buffer or self.queue.count >= AUTOPLAY_LOW_WATER:
+            return
+        if self._prefetch and not self._prefetch.done():
+            return
+
+        self._prefetch = asyncio.create_task(self._fill_autoplay_buffer(guilds))
+
+    async def _fill_autoplay_buffer(self, guilds: GuildRegistry) -> None:
+        try:
+            result = await self._get_recommendations()
+        except Exception as e:
+            log.warning(f"Failed to prefetch autoplay tracks: {e}")
+            return
+
+        if not result or not self.autoplay or self.is_dead:
+            return
+
+        tracks = list(result.tracks)
+        random.shuffle(tracks)
+        self.autoplay_buffer = tracks
+
+        if self.queue.is_empty and self.take_autoplay():
+            await self.update_queue(guilds)
+
+    def take_autoplay(self) -> bool:
+        """ Move prefetched autoplay tracks onto the queue, returns whether anything was added """
+        if not self.autoplay or self.queue.loop_mode or not self.autoplay_buffer:
+            return False
+
+        self.queue.extend(self.autoplay_buffer)
+        self.autoplay_buffer = []
+        return True
+
+    def snapshot(self) -> tuple[Dict[str, Any], List[str]]:
+        """ The state needed to rebuild this player after a restart, and its queue as encoded tracks """
+        track = encoded_track(self.current) if self.current else None
+        queue = self.queue.encoded()
+        return {
+            'guild_id': self.guild.id,
+            'node_id': self.node._identifier,
+            'voice_channel_id': self.channel.id,
+            'track': track,
+            'position': int(self.position) if track else 0,
+            'loop_mode': self.queue.loop_mode.value if self.queue.loop_mode else None,
+            'autoplay': self.autoplay,
+            'volume': self.volume,
+            'paused': self.is_paused,
+        }, queue
+
+    def playlist(self) -> List[str]:
+        """ The current song followed by the queue, as encoded tracks """
+        queue = self.queue.encoded()
+        if self.queue.loop_mode == LoopMode.QUEUE:
+            # A looping queue already holds the current song, as the last one played
+            return queue[-1:] + queue[:-1]
 
-    async def _get_lyrics(self, skip_source: bool = True) -> dict | None:
-        if self.current.track_id in self.last_lyrics:
-            return self.last_lyrics[self.current.track_id]
-        
-        path = f"sessions/{self.node._session_id}/players/{self.guild.id}/track/lyrics"
+        current = encoded_track(self.current) if self.current else None
+        return ([current] if current else []) + queue
+
+    async def restore(self, snapshot: 'AttrDict', queue: List[str]) -> None:
+        """ Rebuild the queue and playback from a snapshot, adopting the Lavalink player if it survived the restart """
+        # Stale tracks are dropped, the current one is decoded apart so a stale one cannot shift the queue into its place
+        current = next(iter(await decode_valid_tracks(self.node, [snapshot.track])), None) if snapshot.track else None
+        tracks = await decode_valid_tracks(self.node, queue)
+
+        self.queue.extend(tracks)
+        self.autoplay = bool(snapshot.autoplay)
+        if current and snapshot.loop_mode:
+            self.queue._current_item = current
+            self.queue.set_loop_mode(LoopMode(snapshot.loop_mode))
+
+        if not current:
+            return
+
+        remote = await self._remote_state()
+        if (remote.get('track') or {}).get('encoded') == current.track_id:
+            # Lavalink kept playing through the restart, only the local state needs rebuilding
+            state = remote.get('state') or {}
+            current.original = current
+            self._current = current
+            self._volume = remote.get('volume', snapshot.volume)
+            self._paused = remote.get('paused', False)
+            self._last_position = int(state.get('position', snapshot.position))
+            self._last_update = int(state.get('time', time.time() * 1000))
+            return
+
+        await self.play(current, start=min(snapshot.position, current.length))
+        if snapshot.volume != self.volume:
+            await self.set_volume(snapshot.volume)
+        if snapshot.paused:
+            await self.set_pause(True)
+
+    async def _remote_state(self) -> dict:
+        try:
+            return await self.node.send(method="GET", path=self._player_endpoint_uri, guild_id=self.guild.id) or {}
+        except pomice.PomiceException:
+            return {}
+
+    def prefetch_lyrics(self) -> None:
+        """ Warm the lyrics cache for the current track in the background """
+        track = self.current
+        if not track or track.is_stream or track.identifier in lyrics:
+            return
+        self._lyrics_task(track)
+
+    def _lyrics_task(self, track: Track, skip_source: bool = False) -> asyncio.Task:
+        if not self._lyrics or self._lyrics.done() or self._lyrics_track != track.identifier:
+            self._lyrics_track = track.identifier
+            self._lyrics = asyncio.create_task(self._fetch_lyrics(track, skip_source))
+        return self._lyrics
+
+    async def _get_lyrics(self, skip_source: bool = False) -> list | None:
+        track = self.current
+        if not track:
+            return None
+
+        cached = lyrics.get(track.identifier)
+        if cached is not MISSING:
+            return cached or None
+
+        return await asyncio.shield(self._lyrics_task(track, skip_source))
+
+    async def _fetch_lyrics(self, track: Track, skip_source: bool) -> list | None:
         query = f"skipTrackSource={str(skip_source).lower()}"
+        encoded = encoded_track(track)
+        if encoded:
+            # Keyed by the track itself, so a track change mid-request cannot mix up the lyrics
+            path = "lyrics"
+            query = f"track={quote(encoded, safe='')}&{query}"
+        else:
+            path = f"sessions/{self.node._session_id}/players/{self.guild.id}/track/lyrics"
 
         try:
             response = await self.node.send(
@@ -34,40 +991,107 @@ class MusicPlayer(Player):
                 path=path,
                 query=query,
             )
-        except pomice.exceptions.NodeRestException as e:
-            print(e)
+        except (pomice.PomiceException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.debug(f"Failed to fetch lyrics for {track.identifier}: {e!r}")
             return None
 
-        if not response:
+        # The player endpoint answers for whatever is playing when the request lands
+        if not encoded and (not self.current or self.current.identifier != track.identifier):
             return None
 
-        self.last_lyrics[self.current.track_id] = response['lines']
-        return response['lines']
+        lines = (response or {}).get('lines') or []
+        lyrics.set(track.identifier, lines)
+        return lines or None
             
+    def live_status(self) -> str:
+        """ Progress bar for the current track, followed by the synced lyric line at the current position """
+        track = self.current
+        if track.is_stream:
+            return '🔴 Live stream'
+
+        position = min(int(self.position), track.length)
+        filled = round(position / track.length * PROGRESS_WIDTH) if track.length else 0
+        status = (
+            f"{'▬' * filled}🔘{'▬' * (PROGRESS_WIDTH - filled)} "
+            f"`{get_duration(position)} / {get_duration(track.length)}`"
+        )
+
+        line = self.lyric_at(position)
+        return f"{status}\n> {line}" if line else status
+
+    def lyric_at(self, position: int) -> Optional[str]:
+        track = self.current
+        if not self._synced or self._synced[0] != track.identifier:
+            if track.identifier not in lyrics:
+                # Fetched once per track, a failed lookup is not retried on every frame
+                if self._lyrics_track != track.identifier:
+                    self.prefetch_lyrics()
+                return None
+
+            lines = [line for line in lyrics.get(track.identifier) or [] if line.get('timestamp') is not None]
+            self._synced = (track.identifier, [line['timestamp'] for line in lines], lines)
+
+        _, timestamps, lines = self._synced
+        index = bisect.bisect_right(timestamps, position) - 1
+        if index < 0:
+            return None
+        return lines[index].get('line') or None
+
     async def _get_recommendations(self) -> Playlist | None:
+        key = (self.current.track_type.value, self.current.identifier)
+        cached = recommendations.get(key)
+        if cached is not MISSING:
+            return copy_result(cached)
+
         if self.current.track_type == TrackType.SPOTIFY:
-            return await self._get_spotify_recommendations()
+            result = await self._get_spotify_recommendations()
         else:
-            return await self._get_youtube_recommendations()
+            result = await self._get_youtube_recommendations()
 
-    async def _get_spotify_recommendations(self) -> Playlist | None:
-        request_url = 'http://spotify-tokener:8080/api/token'
-        resp = await self.node._session.get(request_url)
-        data: dict = await resp.json(loads=json.loads)
-        
-        self._bearer_headers = {
-            "Authorization": f"Bearer {data['accessToken']}",
-        }
-        request_url = f"https://api.spotify.com/v1/recommendations/?seed_tracks={self.current.identifier}"
-        resp = await self.node._session.get(request_url, headers=self._bearer_headers)
+        if result:
+            recommendations.set(key, result)
+        return copy_result(result)
 
-        if resp.status != 200:
+    async def _get_spotify_recommendations(self) -> Playlist | None:
+        token = await spotify_token.get(self.node._session)
+        if not token:
             return None
 
-        data: dict = await resp.json(loads=json.loads)
-        tracks = [Track(track) for track in data["tracks"]]
+        request_url = f"https://api.spotify.com/v1/recommendations?seed_tracks={self.current.identifier}"
+        async with self.node._session.get(request_url, headers={"Authorization": f"Bearer {token}"}) as resp:
+            if resp.status != 200:
+                return None
+            data: dict = await resp.json(loads=json.loads)
 
-        return tracks
+        tracks = [
+            Track(
+                track_id=track['id'],
+                info={
+                    'title': track['name'],
+                    'author': ', '.join(artist['name'] for artist in track['artists']),
+                    'length': track['duration_ms'],
+                    'identifier': track['id'],
+                    'uri': track['external_urls'].get('spotify', ''),
+                    'isrc': track.get('external_ids', {}).get('isrc'),
+                    'thumbnail': next(iter(track['album'].get('images', [])), {}).get('url'),
+                    'isStream': False,
+                    'isSeekable': True,
+                },
+                track_type=TrackType.SPOTIFY,
+                search_type=SearchType.ytmsearch,
+            )
+            for track in data.get('tracks', [])
+        ]
+
+        if not tracks:
+            return None
+
+        return Playlist(
+            playlist_info={'name': 'Spotify Recommendations'},
+            tracks=tracks,
+            playlist_type=PlaylistType.SPOTIFY,
+            thumbnail=tracks[0].thumbnail,
+        )
 
     async def _get_youtube_recommendations(self) -> Playlist:
         identifier = self.current.identifier
@@ -127,41 +1151,34 @@ class MusicPlayer(Player):
         embed.set_footer(text=footer, icon_url=self.bot.user.avatar.url)
         return embed, None
 
-    async def now_playing(self, db: 'Database', view) -> None:
-        guild = await db.fetchone("SELECT * FROM music WHERE guild_id = %s", self.guild.id)
-        channel = self.guild.get_channel(guild['channel_id'])
-        msg = await get_message(channel, guild['message_id'], db)
-        # msg = await channel.fetch_message(guild['message_id'])
+    async def now_playing(self, guilds: GuildRegistry, view) -> None:
+        guilds.queues.mark_dirty(self.guild.id, self.snapshot)
+        guilds.schedule(self.guild, 'controller', lambda: self._render_controller(guilds, view))
 
+    async def _render_controller(self, guilds: GuildRegistry, view) -> None:
+        if not self.current:
+            return
         embed, _ = self._get_embed(self.current)
-        enabled_buttons(view.children)
-
-        if not msg.embeds or msg.embeds[0].description != embed.description:
-            await msg.edit(embed=embed, view=view)
+        state = guilds.get(self.guild.id)
+        if state and state.live:
+            embed.description += f"\n\n{self.live_status()}"
+        apply_controls(view, self.guild, guilds)
+        await guilds.edit(self.guild, 'controller', embed=embed, view=view)
     
-    async def update_queue(self, db: 'Database') -> None:
-        guild_config = await db.fetchone("SELECT * FROM music WHERE guild_id = %s", self.guild.id)
-        if not guild_config:
+    async def update_queue(self, guilds: GuildRegistry) -> None:
+        guilds.queues.mark_dirty(self.guild.id, self.snapshot)
+        if not guilds.get(self.guild.id):
             return
 
-        channel = self.guild.get_channel(guild_config['channel_id'])
-        if not channel:
-            return
+        if self.queue.is_empty:
+            self.take_autoplay()
+        self.prefetch_recommendations(guilds)
 
-        try:
-            queue_msg = await get_message(channel, guild_config['queue_id'], db)
-            # queue_msg = await channel.fetch_message(guild_config['queue_id'])
-        except discord.NotFound:
-            return
-
-        if self.queue.is_empty and self.autoplay and not self.queue.loop_mode:
-            recommendations = await self._get_recommendations()
-            if recommendations:
-                self.queue.extend(recommendations.tracks)
-                self.queue.shuffle()
+        guilds.schedule(self.guild, 'queue', lambda: self._render_queue(guilds))
 
+    async def _render_queue(self, guilds: GuildRegistry) -> None:
         desc = []
-        for i, track in enumerate(list(self.queue.get_queue())[:10], start=1):
+        for i, track in enumerate(self.queue.window(0, 10), start=1):
             desc.append(
                 f"**{i}. {track.title}** "
                 f"[{track.author} ({get_duration(track.length)})]({track.uri})"
@@ -182,21 +1199,34 @@ class MusicPlayer(Player):
             color=self.color
         )
 
-        if not queue_msg.embeds or queue_msg.embeds[0].description != embed.description:
-            await queue_msg.edit(embed=embed)
+        await guilds.edit(self.guild, 'queue', embed=embed)
 
-async def get_message(channel: discord.TextChannel, message_id: int, db: 'Database'):
-    try:
-        msg = await channel.fetch_message(message_id)
-        return msg
-    except discord.NotFound:
-        await db.execute(
-            "DELETE FROM music WHERE channel_id = %s AND guild_id = %s",
-            channel.id, channel.guild.id
+async def decode_tracks(node: pomice.Node, encoded: List[str]) -> List[Track]:
+    """ Decode many encoded tracks with a single Lavalink request """
+    if not encoded:
+        return []
+
+    data = await node.send(method="POST", path="decodetracks", data=encoded)
+    return [
+        Track(
+            track_id=track['encoded'],
+            info=track['info'],
+            track_type=TrackType(track['info']['sourceName']),
         )
-        return
-    except discord.errors.DiscordServerError as e:
-        return None
+        for track in data
+    ]
+
+async def decode_valid_tracks(node: pomice.Node, encoded: List[str]) -> List[Track]:
+    """ Like decode_tracks, but tracks Lavalink can no longer decode are dropped instead of failing the whole batch """
+    try:
+        return await decode_tracks(node, encoded)
+    except pomice.exceptions.NodeRestException:
+        if len(encoded) <= 1:
+            return []
+
+    # Halve the batch until the bad tracks are isolated, a few requests instead of one per track
+    middle = len(encoded) // 2
+    return await decode_valid_tracks(node, encoded[:middle]) + await decode_valid_tracks(node, encoded[middle:])
 
 def same_vc(itr: Interaction, player: 'MusicPlayer'):
     if not itr.user.voice:
@@ -232,29 +1262,44 @@ async def reset_embeds(music, player: 'MusicPlayer'):
     if not player or not player.guild:
         return
 
-    guild = await music.bot.db.fetchone("SELECT * FROM music WHERE guild_id = %s", player.guild.id)
-
-    if not guild:
+    if not music.guilds.get(player.guild.id):
         return
 
     await player.destroy()
     player.queue.clear()
+    schedule_reset(music.guilds, player.guild, music.view)
+
+def schedule_reset(guilds: GuildRegistry, guild: discord.Guild, view):
+    guilds.queues.discard(guild.id)
+    embed, embed2 = default_embed(view.bot)
 
-    channel = player.guild.get_channel(guild['channel_id'])
-    message = await get_message(channel, guild['message_id'], music.bot.db)
-    queue_message = await get_message(channel, guild['queue_id'], music.bot.db)
-    # message = await channel.fetch_message(guild['message_id'])
-    # queue_message = await channel.fetch_message(guild['queue_id'])
+    async def render():
+        apply_controls(view, guild, guilds)
+        await guilds.edit(guild, 'controller', embed=embed, view=view)
 
-    embed, embed2 = default_embed(music.view.bot)
+    guilds.schedule(guild, 'controller', render)
+    guilds.schedule(guild, 'queue', lambda: guilds.edit(guild, 'queue', embed=embed2))
 
-    disabled_buttons(music.view.children)
+def apply_controls(view, guild: discord.Guild, guilds: GuildRegistry) -> None:
+    """
+    Set the shared controller buttons to one guild's state.
+    Every guild renders the same view, so this runs inside the render, right before the edit is sent.
+    """
+    player = guild.voice_client
+    playing = isinstance(player, MusicPlayer) and player.current is not None
+    state = guilds.get(guild.id)
+    locked = bool(state and state.locked)
 
-    if not message.embeds or message.embeds[0].description != embed.description:
-        await message.edit(embed=embed, view=music.view)
+    if playing and not locked:
+        enabled_buttons(view.children)
+    else:
+        disabled_buttons(view.children)
 
-    if not queue_message.embeds or queue_message.embeds[0].description != embed2.description:
-        await queue_message.edit(embed=embed2)
+    for child in view.children:
+        if child.custom_id == 'btn-pause':
+            child.emoji = RESUME_EMOJI if playing and player.is_paused else PAUSE_EMOJI
+        elif child.custom_id == 'btn-lock':
+            child.emoji = LOCK_EMOJI if locked else UNLOCK_EMOJI
 
 def disabled_buttons(children):
     for child in children:
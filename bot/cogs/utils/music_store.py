@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set
+
+from pomice import Track
+
+if TYPE_CHECKING:
+    from bot.utils.database import Database
+    from bot.utils.types import AttrDict
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+FLUSH_DELAY = 5.0
+
+
+def lavalink_track(track: Track) -> Optional[Track]:
+    """ The track Lavalink loaded, Spotify Web API tracks only have one once they have been played """
+    for candidate in (track, track.original):
+        if candidate is not None and 'sourceName' in candidate.info:
+            return candidate
+    return None
+
+
+def encoded_track(track: Track) -> Optional[str]:
+    loaded = lavalink_track(track)
+    return loaded.track_id if loaded else None
+
+
+def batches(encoded: List[str]) -> List[str]:
+    return ['\n'.join(encoded[i:i + BATCH_SIZE]) for i in range(0, len(encoded), BATCH_SIZE)]
+
+
+async def save_queue(db: 'Database', guild_id: int, encoded: List[str]) -> None:
+    """ Store a queue as newline separated batches of encoded tracks, one row per batch """
+    rows = [(guild_id, i, batch) for i, batch in enumerate(batches(encoded))]
+    if rows:
+        await db.executemany("REPLACE INTO music_queue (guild_id, batch, tracks) VALUES (%s, %s, %s)", rows)
+
+    # Trailing batches go last so a crash mid-write never leaves the queue empty
+    await db.execute("DELETE FROM music_queue WHERE guild_id = %s AND batch >= %s", guild_id, len(rows))
+
+
+async def load_queue(db: 'Database', guild_id: int) -> List[str]:
+    rows = await db.fetchall("SELECT tracks FROM music_queue WHERE guild_id = %s ORDER BY batch", guild_id)
+    return [encoded for row in rows for encoded in row.tracks.split('\n') if encoded]
+
+
+SNAPSHOT_COLUMNS = ('guild_id', 'node_id', 'voice_channel_id', 'track', 'position', 'loop_mode', 'autoplay', 'volume', 'paused')
+
+
+async def save_player(db: 'Database', snapshot: Dict[str, Any], queue: List[str]) -> None:
+    await db.execute(
+        f"REPLACE INTO music_players ({', '.join(SNAPSHOT_COLUMNS)}) "
+        f"VALUES ({', '.join(['%s'] * len(SNAPSHOT_COLUMNS))})",
+        *(snapshot[column] for column in SNAPSHOT_COLUMNS)
+    )
+    await save_queue(db, snapshot['guild_id'], queue)
+
+
+async def load_players(db: 'Database') -> List['AttrDict']:
+    return await db.fetchall("SELECT * FROM music_players")
+
+
+async def delete_player(db: 'Database', guild_id: int) -> None:
+    await db.execute("DELETE FROM music_players WHERE guild_id = %s", guild_id)
+    await db.execute("DELETE FROM music_queue WHERE guild_id = %s", guild_id)
+
+
+async def save_playlist(db: 'Database', guild_id: int, name: str, encoded: List[str], created_by: int) -> None:
+    """ Store a named playlist of the guild as ordered encoded tracks, replacing the tracks of one with the same name """
+    await db.execute(
+        "INSERT INTO music_playlists (guild_id, name, tracks, track_count, created_by) VALUES (%s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE tracks = VALUES(tracks), track_count = VALUES(track_count)",
+        guild_id, name, '\n'.join(encoded), len(encoded), created_by
+    )
+
+
+async def load_playlist(db: 'Database', guild_id: int, name: str) -> Optional[List[str]]:
+    row = await db.fetchone("SELECT tracks FROM music_playlists WHERE guild_id = %s AND name = %s", guild_id, name)
+    return [encoded for encoded in row.tracks.split('\n') if encoded] if row else None
+
+
+async def list_playlists(db: 'Database', guild_id: int, prefix: str = '', limit: int = 25) -> List['AttrDict']:
+    return await db.fetchall(
+        "SELECT name, track_count, created_by FROM music_playlists "
+        "WHERE guild_id = %s AND name LIKE %s ORDER BY name LIMIT %s",
+        guild_id, prefix.replace('%', r'\%').replace('_', r'\_') + '%', limit
+    )
+
+
+async def find_playlist(db: 'Database', guild_id: int, name: str) -> Optional['AttrDict']:
+    return await db.fetchone(
+        "SELECT name, track_count, created_by FROM music_playlists WHERE guild_id = %s AND name = %s",
+        guild_id, name
+    )
+
+
+async def delete_playlist(db: 'Database', guild_id: int, name: str) -> None:
+    await db.execute("DELETE FROM music_playlists WHERE guild_id = %s AND name = %s", guild_id, name)
+
+
+class QueueStore:
+    """ Write-behind persistence of player snapshots, flushing each guild at most once every `delay` seconds """
+
+    def __init__(self, db: 'Database', delay: float = FLUSH_DELAY):
+        self.db = db
+        self.delay = delay
+        self.marked = 0
+        self.flushes = 0
+        self._dirty: Dict[int, Callable[[], tuple]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._deletes: Set[asyncio.Task] = set()
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _lock(self, guild_id: int) -> asyncio.Lock:
+        # One guild's writes and deletes take turns, so a delete can never land before a write still in progress
+        return self._locks.setdefault(guild_id, asyncio.Lock())
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def mark_dirty(self, guild_id: int, snapshot: Callable[[], tuple]) -> None:
+        """ Schedule a flush, `snapshot` is only called when the write happens """
+        self.marked += 1
+        self._dirty[guild_id] = snapshot
+        if guild_id not in self._tasks:
+            self._tasks[guild_id] = asyncio.create_task(self._flush_later(guild_id))
+
+    def discard(self, guild_id: int) -> None:
+        """ Forget a destroyed player, pending writes included """
+        self._dirty.pop(guild_id, None)
+        task = self._tasks.pop(guild_id, None)
+        if task:
+            task.cancel()
+
+        if self.db.music:
+            task = asyncio.create_task(self._delete(guild_id))
+            self._deletes.add(task)
+            task.add_done_callback(self._deletes.discard)
+
+    async def _delete(self, guild_id: int) -> None:
+        async with self._lock(guild_id):
+            try:
+                await delete_player(self.db, guild_id)
+            except Exception as e:
+                log.warning(f"Failed to delete the saved player of guild {guild_id}: {e}")
+
+    async def flush(self, guild_id: int) -> None:
+        async with self._lock(guild_id):
+            # Taken under the lock, a discard while waiting for it leaves nothing to write
+            snapshot = self._dirty.pop(guild_id, None)
+            if snapshot is None or not self.db.music:
+                return
+
+            try:
+                state, queue = snapshot()
+                await save_player(self.db, state, queue)
+                self.flushes += 1
+            except Exception as e:
+                log.warning(f"Failed to persist the queue of guild {guild_id}: {e}")
+
+    async def flush_all(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+        if self._deletes:
+            await asyncio.wait(self._deletes)
+        for guild_id in list(self._dirty):
+            await self.flush(guild_id)
+
+    async def _flush_later(self, guild_id: int) -> None:
+        await asyncio.sleep(self.delay)
+        # From here on a discard waits on the lock instead of cancelling a write midway
+        self._tasks.pop(guild_id, None)
+        await self.flush(guild_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {'marked': self.marked, 'flushes': self.flushes, 'pending': self.pending}
@@ -1,5 +1,5 @@
-from typing import Optional, List, Union
-from discord import Interaction, SelectOption, User, ButtonStyle
+from typing import Optional, List, Sequence, Type, Union
+from discord import Embed, Interaction, SelectOption, User, ButtonStyle
 from discord.ui import View, Select, button, Button
 
 
@@ -15,7 +15,7 @@ class PageSelect(Select):
 
 
 class PageView(View):
-    def __init__(self, author: User, pages: List[SelectOption], limited: bool):
+    def __init__(self, author: User, pages: Sequence[Embed], limited: bool):
         super().__init__(timeout=180)
         self.author = author
         self.pages = pages
@@ -28,14 +28,21 @@ class PageView(View):
     async def interaction_check(self, itr: Interaction) -> bool:
         return itr.user.id == self.author.id
 
+    def render_page(self) -> Embed:
+        return self.pages[self.current_page]
+
     async def update_children(self, itr: Interaction):
+        if self.limited:
+            self.current_page = min(self.current_page, len(self.pages) - 1)
+        self.current_page = max(self.current_page, 0)
+
         self.label.label = f'{self.current_page + 1}/{len(self.pages)}' if self.limited else self.current_page+1
         self.next.disabled = (self.current_page + 1 == len(self.pages) and self.limited) 
         self.last.disabled = (self.current_page + 1 == len(self.pages) and self.limited) 
         self.previous.disabled = (self.current_page <= 0)
         self.first.disabled = (self.current_page <= 0)
 
-        await itr.response.edit_message(embed=self.pages[self.current_page], view=self)
+        await itr.response.edit_message(embed=self.render_page(), view=self)
 
     @button(label="◀◀", style=ButtonStyle.gray, row=1)
     async def first(self, itr: Interaction, _: Button):
@@ -78,20 +85,22 @@ class Paginator:
     def __init__(
             self, itr: Interaction, pages: list,
             custom_children: Optional[List[Union[Button, Select]]] = None, 
-            limited: bool = True, next_page_callback=None
+            limited: bool = True, next_page_callback=None, view_cls: Type[PageView] = PageView
     ):
+        """ `pages` can be any sequence, pages are only read when they are shown """
         self.custom_children = custom_children or []
         self.itr = itr
         self.pages = pages
         self.next_page_callback = next_page_callback
         self.limited = limited
+        self.view_cls = view_cls
 
     async def start(self, quick_navigation: bool = False) -> None:
-        if len(self.pages) == 1:
+        if len(self.pages) == 1 and self.view_cls is PageView:
             await self.itr.edit_original_response(embed=self.pages[0], view=None)
             return
 
-        view = PageView(self.itr.user, self.pages, limited=self.limited)
+        view = self.view_cls(self.itr.user, self.pages, limited=self.limited)
         view.next_page_callback = self.next_page_callback
 
         view.previous.disabled = view.current_page <= 0
@@ -106,7 +115,7 @@ class Paginator:
                 view.add_item(child)
 
         try:
-            embed = self.pages[view.current_page]
+            embed = view.render_page()
         except IndexError:
             embed = None
 
@@ -0,0 +1,216 @@
+import random
+from collections import deque
+from itertools import islice
+from typing import Deque, Iterable, Iterator, List, Optional
+
+import discord
+from pomice import LoopMode, SearchType, Track, TrackType
+from pomice.exceptions import QueueEmpty, QueueException
+
+from bot.cogs.utils.music_store import lavalink_track
+
+
+class QueueEntry:
+    """ What the queue keeps of a track, the full `Track` is only built when it is played or shown in detail """
+
+    __slots__ = (
+        'encoded', 'title', 'author', 'length', 'uri', 'identifier',
+        'source', 'thumbnail', 'isrc', 'is_stream', 'requester_id',
+    )
+
+    def __init__(
+        self, encoded: Optional[str], title: str, author: str, length: int, uri: str, identifier: str,
+        source: str, thumbnail: Optional[str] = None, isrc: Optional[str] = None, is_stream: bool = False,
+        requester_id: Optional[int] = None,
+    ):
+        self.encoded = encoded
+        self.title = title
+        self.author = author
+        self.length = length
+        self.uri = uri
+        self.identifier = identifier
+        self.source = source
+        self.thumbnail = thumbnail
+        self.isrc = isrc
+        self.is_stream = is_stream
+        self.requester_id = requester_id
+
+    @classmethod
+    def from_track(cls, track: Track) -> 'QueueEntry':
+        loaded = lavalink_track(track)
+        return cls(
+            encoded=loaded.track_id if loaded else None,
+            title=track.title,
+            author=track.author,
+            length=track.length,
+            uri=track.uri,
+            identifier=track.identifier,
+            source=loaded.info['sourceName'] if loaded else track.track_type.value,
+            thumbnail=track.thumbnail,
+            isrc=track.isrc,
+            is_stream=track.is_stream,
+            requester_id=track.requester.id if track.requester else None,
+        )
+
+    def build(self, guild: Optional[discord.Guild] = None) -> Track:
+        info = {
+            'title': self.title,
+            'author': self.author,
+            'length': self.length,
+            'uri': self.uri,
+            'identifier': self.identifier,
+            'isrc': self.isrc,
+            'thumbnail': self.thumbnail,
+            'artworkUrl': self.thumbnail,
+            'isStream': self.is_stream,
+            'isSeekable': not self.is_stream,
+        }
+        if self.encoded:
+            info['sourceName'] = self.source
+
+        track = Track(
+            track_id=self.encoded or self.identifier,
+            info=info,
+            track_type=TrackType(self.source),
+            search_type=SearchType.ytmsearch,
+        )
+        if self.encoded:
+            # Lavalink plays the encoded track as is, pomice would otherwise search Spotify tracks again
+            track.original = track
+        if guild and self.requester_id:
+            track.requester = guild.get_member(self.requester_id)
+        return track
+
+
+class CompactQueue:
+    """
+    Deque of `QueueEntry` with the parts of pomice's `Queue` interface the music code uses.
+    In queue loop the deque rotates, `_played` counts the entries at its tail already played this cycle.
+    """
+
+    def __init__(self, guild: Optional[discord.Guild] = None):
+        self.guild = guild
+        self._entries: Deque[QueueEntry] = deque()
+        self._loop_mode: Optional[LoopMode] = None
+        self._current_item: Optional[Track] = None
+        self._played = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def __iter__(self) -> Iterator[QueueEntry]:
+        return iter(self._entries)
+
+    @property
+    def count(self) -> int:
+        return len(self._entries)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self._entries
+
+    @property
+    def loop_mode(self) -> Optional[LoopMode]:
+        return self._loop_mode
+
+    def get(self) -> Track:
+        if self._loop_mode == LoopMode.TRACK and self._current_item:
+            return self._current_item
+
+        if not self._entries:
+            raise QueueEmpty("No items in the queue.")
+
+        entry = self._entries.popleft()
+        if self._loop_mode == LoopMode.QUEUE:
+            self._entries.append(entry)
+            self._played = self._played % len(self._entries) + 1
+
+        self._current_item = entry.build(self.guild)
+        return self._current_item
+
+    def peek(self) -> Optional[Track]:
+        return self._entries[0].build(self.guild) if self._entries else None
+
+    def put(self, track: Track) -> None:
+        self.extend([track])
+
+    def extend(self, tracks: Iterable[Track]) -> None:
+        """ Add tracks after the upcoming ones, ahead of anything already played this loop """
+        entries = map(QueueEntry.from_track, tracks)
+        if not self._played:
+            return self._entries.extend(entries)
+
+        self._entries.rotate(self._played)
+        self._entries.extend(entries)
+        self._entries.rotate(-self._played)
+
+    def put_at_front(self, track: Track) -> None:
+        self._entries.appendleft(QueueEntry.from_track(track))
+
+    def remove(self, index: int) -> QueueEntry:
+        entry = self._entries[index]
+        del self._entries[index]
+        if index >= len(self._entries) - self._played + 1:
+            self._played -= 1
+        return entry
+
+    def move(self, index: int, to: int) -> None:
+        entry = self.remove(index)
+        self._entries.insert(to, entry)
+        if to > len(self._entries) - 1 - self._played:
+            self._played += 1
+
+    def index(self, entry: QueueEntry) -> int:
+        return self._entries.index(entry)
+
+    def window(self, start: int, stop: int) -> List[QueueEntry]:
+        return list(islice(self._entries, start, stop))
+
+    def encoded(self) -> List[str]:
+        return [entry.encoded for entry in self._entries if entry.encoded]
+
+    def _reorder(self, reorder) -> None:
+        upcoming = list(islice(self._entries, 0, len(self._entries) - self._played))
+        played = list(islice(self._entries, len(upcoming), None))
+        reorder(upcoming)
+        self._entries = deque(upcoming + played)
+
+    def shuffle(self) -> None:
+        self._reorder(random.shuffle)
+
+    def reverse(self) -> None:
+        self._reorder(list.reverse)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._played = 0
+
+    def set_loop_mode(self, mode: LoopMode) -> None:
+        self._loop_mode = mode
+        if mode != LoopMode.QUEUE:
+            return
+
+        self._played = 0
+        if self._current_item is None:
+            return
+
+        current = QueueEntry.from_track(self._current_item)
+        last = self._entries[-1] if self._entries else None
+        # A restored loop already ends with the current track
+        if not (last and current.encoded and last.encoded == current.encoded):
+            self._entries.append(current)
+        self._played = 1
+
+    def disable_loop(self) -> None:
+        if not self._loop_mode:
+            raise QueueException("Queue loop is already disabled.")
+
+        if self._loop_mode == LoopMode.QUEUE:
+            for _ in range(self._played):
+                self._entries.pop()
+            self._played = 0
+
+        self._loop_mode = None
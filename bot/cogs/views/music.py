@@ -1,23 +1,37 @@
 import asyncio
 from io import StringIO
 import re
-from typing import TYPE_CHECKING, cast
+from typing import TYPE_CHECKING, List, Optional, cast
 import discord
-from discord import Button, Interaction
+from discord import Button, ButtonStyle, Interaction, SelectOption
 from discord.ui import View
+import pomice
 from pomice import Track
 from pomice.enums import LoopMode
-from bot.cogs.utils.music import MusicPlayer, get_duration, get_message
+from bot.cogs.utils.music import (
+    INGEST_CONCURRENCY,
+    UNAVAILABLE,
+    YOUTUBE_ID,
+    MusicPlayer,
+    decode_valid_tracks,
+    get_duration,
+    governor,
+)
+from bot.cogs.utils.music_store import encoded_track
+from bot.cogs.utils.paginator import PageView
+from bot.cogs.utils.queue import QueueEntry
 
 if TYPE_CHECKING:
     from bot import MyBot
     from bot.utils.database import Database
     from bot.cogs.music import Music
+    from bot.cogs.utils.music import GuildRegistry
 
 from bot.cogs.utils.music import (
-    disabled_buttons, 
-    enabled_buttons, 
+    apply_controls,
+    default_embed,
     same_vc, 
+    schedule_reset,
 )
 
 class MusicButtons(View):
@@ -34,11 +48,28 @@ class MusicButtons(View):
 
         if not same_vc(interaction, player):
             self.error.description = 'You must be in the same VC to operate'
-            await interaction.response.send_message(embed=self.error, ephemeral=True, delete_after=5)
+            await interaction.response.send_message(embed=self.error, ephemeral=True)
+            self.bot.deletions.schedule(interaction.delete_original_response, 5)
             return False
 
+        # Loop, volume and pause changes are picked up when the snapshot is written
+        self.parent.guilds.queues.mark_dirty(interaction.guild.id, player.snapshot)
         return True
 
+    def render_controller(self, guild: discord.Guild) -> None:
+        player = cast(MusicPlayer, guild.voice_client)
+        guilds = self.parent.guilds
+
+        async def render():
+            if player and player.current:
+                embed, _ = player._get_embed(player.current)
+            else:
+                embed, _ = default_embed(self.bot)
+            apply_controls(self, guild, guilds)
+            await guilds.edit(guild, 'controller', embed=embed, view=self)
+
+        guilds.schedule(guild, 'controller', render)
+
     @discord.ui.button(emoji='<:Repeat:1158995878615453746>', custom_id='btn-repeat-song')
     async def repeat_song(self, itr: Interaction, _: Button):
         player = cast(MusicPlayer, itr.guild.voice_client)
@@ -50,7 +81,8 @@ class MusicButtons(View):
                 description='Stopped looping the current track.',
                 color=discord.Color.red()
             )
-            await itr.response.send_message(embed=embed, ephemeral=True, delete_after=5)
+            await itr.response.send_message(embed=embed, ephemeral=True)
+            self.bot.deletions.schedule(itr.delete_original_response, 5)
         else:
             player.queue.set_loop_mode(LoopMode.TRACK)
             self.success.description = 'Song loop ENABLED'
@@ -59,49 +91,44 @@ class MusicButtons(View):
                 description=f'Now looping: [{player.current.title}]({player.current.uri})',
                 color=discord.Color.green()
             )
-            await itr.response.send_message(embed=self.success, ephemeral=True, delete_after=5)
+            await itr.response.send_message(embed=self.success, ephemeral=True)
+            self.bot.deletions.schedule(itr.delete_original_response, 5)
 
     @discord.ui.button(emoji='<:backward2white:1158995843857252472>', custom_id='btn-play-last')
     async def play_last(self, itr: Interaction, _: Button):
         await itr.response.defer()
         player = cast(MusicPlayer, itr.guild.voice_client)
-        previous = self.parent.last_songs[-1] if self.parent.last_songs else None
+        state = self.parent.guilds.get(itr.guild.id)
 
-        if not previous:
+        if not state or not state.history:
             msg = await itr.followup.send(content="`Looks like there's no song played before this one.`", ephemeral=True)
-            await asyncio.sleep(10)
-            return await msg.delete()
+            return self.bot.deletions.schedule(msg.delete, 10)
 
         player.current.info['play_last'] = True
         await player.stop()
 
     @discord.ui.button(emoji='<:Pause:1158995866221281331>', custom_id='btn-pause')
-    async def play_pause(self, itr: Interaction, btn: Button):
+    async def play_pause(self, itr: Interaction, _: Button):
         await itr.response.defer()
         player = cast(MusicPlayer, itr.guild.voice_client)
 
         if player.is_paused:
             self.success.description = 'Music Resumed'
-            btn.emoji = '<:Pause:1158995866221281331>'
             await player.set_pause(False)
-            await itr.edit_original_response(view=self)
+            self.render_controller(itr.guild)
             msg = await itr.followup.send(embed=self.success, ephemeral=True)
-            await asyncio.sleep(5)
-            return await msg.delete()
+            return self.bot.deletions.schedule(msg.delete, 5)
         
         self.success.description = 'Music Paused'
-        btn.emoji = '<:Resume:1158995889591955466>'
         await player.set_pause(True)
-        await itr.edit_original_response(view=self)
+        self.render_controller(itr.guild)
         msg = await itr.followup.send(embed=self.success, ephemeral=True)
-        await asyncio.sleep(5)
-        return await msg.delete()
+        return self.bot.deletions.schedule(msg.delete, 5)
 
     @discord.ui.button(emoji='<:forward2white:1158995848294838272>', custom_id='btn-play-next')
     async def play_next(self, itr: Interaction, _: Button):
         player = cast(MusicPlayer, itr.guild.voice_client)
-        queue = player.queue.get_queue()
-        song: Track = queue[0] if len(queue) != 0 else None
+        song: Track = player.queue.peek()
         await player.stop()
 
         embed = discord.Embed(
@@ -116,7 +143,9 @@ class MusicButtons(View):
             embed.add_field(name="Requested by", value=str(song.requester.display_name) if song.requester else "")
             embed.set_thumbnail(url=song.thumbnail)
 
-        await itr.response.send_message(embed=embed, ephemeral=True, delete_after=15)
+        await itr.response.send_message(embed=embed, ephemeral=True)
+
+        self.bot.deletions.schedule(itr.delete_original_response, 15)
 
     @discord.ui.button(emoji='<:RepeatPlaylist:1158995882918817883>', custom_id='btn-repeat-playlist')
     async def repeat_playlist(self, itr: Interaction, _: Button):
@@ -129,17 +158,19 @@ class MusicButtons(View):
                 description='The playlist will no longer repeat once it ends.',
                 color=discord.Color.red()
             )
-            await itr.response.send_message(embed=embed, ephemeral=True, delete_after=5)
+            await itr.response.send_message(embed=embed, ephemeral=True)
+            self.bot.deletions.schedule(itr.delete_original_response, 5)
         else:
             player.queue.set_loop_mode(LoopMode.QUEUE)
-            songs = len(player.queue.get_queue())
+            songs = player.queue.count
             embed = discord.Embed(
                 title='🔁 Playlist Loop Enabled',
                 description=f'The playlist ({songs} Songs) will now loop continuously.',
                 color=discord.Color.green()
             )
             self.success.description = 'Playlist loop ENABLED'
-            await itr.response.send_message(embed=self.success, ephemeral=True, delete_after=5)
+            await itr.response.send_message(embed=self.success, ephemeral=True)
+            self.bot.deletions.schedule(itr.delete_original_response, 5)
 
     @discord.ui.button(emoji='<:VolumeDown:1158995920466235392>', custom_id='btn-volume-down')
     async def volume_down(self, itr: Interaction, _: Button):
@@ -149,18 +180,18 @@ class MusicButtons(View):
         await player.set_volume(new_volume)
 
         self.success.description = f'Volume set to {new_volume}'
-        await itr.response.send_message(embed=self.success, ephemeral=True, delete_after=5)
+        await itr.response.send_message(embed=self.success, ephemeral=True)
+        self.bot.deletions.schedule(itr.delete_original_response, 5)
 
     @discord.ui.button(emoji='<:reverse:1158995896193785956>', custom_id='btn-reverse')
     async def reverse_queue(self, itr: Interaction, _: Button):
         player = cast(MusicPlayer, itr.guild.voice_client)
 
-        reversed_songs = list(reversed(player.queue.get_queue()))
-        player.queue.clear()
-        player.queue.extend(reversed_songs)
-        await player.update_queue(self.db)
+        player.queue.reverse()
+        await player.update_queue(self.parent.guilds)
         self.success.description = 'Queue Reversed'
-        await itr.response.send_message(embed=self.success, delete_after=5, ephemeral=True)
+        await itr.response.send_message(embed=self.success, ephemeral=True)
+        self.bot.deletions.schedule(itr.delete_original_response, 5)
 
     @discord.ui.button(emoji='<:cross:1158996277833506866>', custom_id='btn-destroy')
     async def destroy(self, itr: Interaction, _: Button):
@@ -168,28 +199,14 @@ class MusicButtons(View):
         player = cast(MusicPlayer, itr.guild.voice_client)
         await player.destroy()
         player.queue.clear()
-
-        guild = await self.db.fetchone("SELECT * FROM music WHERE guild_id = %s", itr.guild.id)
-        message = await get_message(itr.channel, guild['message_id'], self.db)
-        queue_message = await get_message(itr.channel, guild['queue_id'], self.db)
-        # message = await itr.channel.fetch_message(guild['message_id'])
-        # queue_message = await itr.channel.fetch_message(guild['queue_id'])
-
-        if not message or not queue_message:
-            return
-
-        embed, embed2 = player._get_embed()
-        disabled_buttons(self.children)
-
-        await message.edit(embed=embed, view=self)
-        await queue_message.edit(embed=embed2)
+        schedule_reset(self.parent.guilds, itr.guild, self)
 
     @discord.ui.button(emoji='<:Shuffle:1158995909636538458>', custom_id='btn-shuffle')
     async def shuffle(self, itr: Interaction, _: Button):
         await itr.response.defer()
         player = cast(MusicPlayer, itr.guild.voice_client)
         player.queue.shuffle()
-        await player.update_queue(self.db)
+        await player.update_queue(self.parent.guilds)
 
     @discord.ui.button(emoji='<:VolumeUp:1158995926938046474>', custom_id='btn-volume-up')
     async def volume_up(self, itr: Interaction, _: Button):
@@ -198,33 +215,30 @@ class MusicButtons(View):
         new_volume = min(player.volume + 10, 300)
         await player.set_volume(new_volume)
         self.success.description = f'Volume set to {new_volume}'
-        await itr.response.send_message(embed=self.success, ephemeral=True, delete_after=5)
+        await itr.response.send_message(embed=self.success, ephemeral=True)
+        self.bot.deletions.schedule(itr.delete_original_response, 5)
 
     @discord.ui.button(emoji='<:Lock:1158995859992744008>', custom_id='btn-lock')
-    async def lock(self, itr: Interaction, btn: Button):
+    async def lock(self, itr: Interaction, _: Button):
         await itr.response.defer()
 
-        guild = await self.db.fetchone("SELECT * FROM music WHERE guild_id = %s", itr.guild.id)
+        state = self.parent.guilds.get(itr.guild.id)
+        if not state:
+            return
 
-        if guild['locked']:
-            btn.emoji = '<Unlock:1158995915508564008>'
+        if state.locked:
             self.success.description = 'Music Channel Unlocked'
-            await self.db.execute("UPDATE music SET locked = %s WHERE guild_id = %s", False, itr.guild.id)
-            enabled_buttons(self.children)
-            await itr.edit_original_response(view=self)
+            await self.parent.guilds.set_locked(itr.guild.id, False)
+            self.render_controller(itr.guild)
             msg = await itr.followup.send(embed=self.success, ephemeral=True)
-            await asyncio.sleep(5)
-            return await msg.delete()
+            return self.bot.deletions.schedule(msg.delete, 5)
 
         else:
-            btn.emoji = '<Lock:1158995859992744008>'
             self.success.description = 'Music Channel Locked'
-            await self.db.execute("UPDATE music SET locked = %s WHERE guild_id = %s", True, itr.guild.id)
-            disabled_buttons(self.children)
-            await itr.edit_original_response(view=self)
+            await self.parent.guilds.set_locked(itr.guild.id, True)
+            self.render_controller(itr.guild)
             msg = await itr.followup.send(embed=self.success, ephemeral=True)
-            await asyncio.sleep(5)
-            return await msg.delete()
+            return self.bot.deletions.schedule(msg.delete, 5)
 
     @discord.ui.button(emoji='<:autoplay:1158995839117705235>', custom_id='btn-autoplay')
     async def autoplay(self, itr: Interaction, _: Button):
@@ -234,15 +248,18 @@ class MusicButtons(View):
             player.autoplay = True
 
             if player.queue.is_empty:
-                await player.update_queue(self.db)
+                await player.update_queue(self.parent.guilds)
 
             self.success.description = 'AutoPlay enabled, this feature will add songs to the queue automatically'
-            await itr.response.send_message(embed=self.success, ephemeral=True, delete_after=5)
+            await itr.response.send_message(embed=self.success, ephemeral=True)
+            self.bot.deletions.schedule(itr.delete_original_response, 5)
 
         else:
             player.autoplay = False
+            player.autoplay_buffer = []
             self.success.description = 'AutoPlay disabled, this feature will add songs to the queue automatically'
-            await itr.response.send_message(embed=self.success, ephemeral=True, delete_after=5)
+            await itr.response.send_message(embed=self.success, ephemeral=True)
+            self.bot.deletions.schedule(itr.delete_original_response, 5)
 
     @discord.ui.button(emoji='<:Like:1158995854661791794>', custom_id='btn-like-song')
     async def like_song(self, itr: Interaction, _: Button):
@@ -250,19 +267,26 @@ class MusicButtons(View):
         player = cast(MusicPlayer, itr.guild.voice_client)
 
         song = await self.db.fetchone(
-            "SELECT song FROM favorite_music WHERE user_id = %s and song = %s",
+            "SELECT id, encoded FROM favorite_music WHERE user_id = %s and song = %s",
             itr.user.id, player.current.identifier
         )
 
+        encoded = encoded_track(player.current)
+        if song and not song.encoded and encoded:
+            # Liked before encoded tracks were stored, keep the like and fill the track in
+            await self.db.execute("UPDATE favorite_music SET encoded = %s WHERE id = %s", encoded, song.id)
+            self.success.description = f'{player.current.title} is in your liked songs'
+            msg = await itr.followup.send(embed=self.success, ephemeral=True)
+            return self.bot.deletions.schedule(msg.delete, 5)
+
         if not song:
             await self.db.execute(
-                "INSERT INTO favorite_music (song, user_id) VALUES (%s, %s)",
-                player.current.identifier, itr.user.id
+                "INSERT INTO favorite_music (song, encoded, user_id) VALUES (%s, %s, %s)",
+                player.current.identifier, encoded, itr.user.id
             )
             self.success.description = f'Successfully added {player.current.title} to liked songs'
             msg = await itr.followup.send(embed=self.success, ephemeral=True)
-            await asyncio.sleep(5)
-            return await msg.delete()
+            return self.bot.deletions.schedule(msg.delete, 5)
 
         await self.db.execute(
             "DELETE FROM favorite_music WHERE song = %s AND user_id = %s",
@@ -271,8 +295,7 @@ class MusicButtons(View):
 
         self.success.description = f'Successfully removed {player.current.title} from liked songs'
         msg = await itr.followup.send(embed=self.success, ephemeral=True)
-        await asyncio.sleep(5)
-        return await msg.delete()
+        return self.bot.deletions.schedule(msg.delete, 5)
 
     @discord.ui.button(emoji='<:lyrics:1394167977351450776>', custom_id='btn-lyric')
     async def lyrics(self, itr: Interaction, _: Button):
@@ -299,39 +322,86 @@ class MusicButtons(View):
         await itr.response.defer()
         player = cast(MusicPlayer, itr.guild.voice_client)
 
-        liked_music_list = await self.db.fetchall("SELECT * FROM favorite_music WHERE user_id = %s", itr.user.id)
+        liked_music_list = await self.db.fetchall(
+            "SELECT id, song, encoded FROM favorite_music WHERE user_id = %s ORDER BY id",
+            itr.user.id
+        )
 
         if not liked_music_list:
             msg = await itr.followup.send('Your liked song list is empty!', ephemeral=True)
-            await asyncio.sleep(5)
-            return await msg.delete()
+            return self.bot.deletions.schedule(msg.delete, 5)
 
         if not player:
             if not itr.user.voice:
                 await itr.followup.send('You must be in a vc to listen to music', ephemeral=True)
                 return
 
-            player = await itr.user.voice.channel.connect(cls=MusicPlayer)
+            try:
+                player = await itr.user.voice.channel.connect(cls=MusicPlayer)
+            except pomice.PomiceException:
+                return await itr.followup.send(UNAVAILABLE, ephemeral=True)
 
         if itr.user.voice.channel.id != player.channel.id:
             await itr.followup.send('You must be in the same vc to listen to music', ephemeral=True)
             return
 
-        for item in liked_music_list:
+        # Likes saved before favorite_music stored encoded tracks can only be loaded back from a YouTube id
+        liked = [item for item in liked_music_list if item.encoded or YOUTUBE_ID.match(item.song)]
+        allowed = governor.fit(player, liked)
+        if not allowed:
+            msg = await itr.followup.send(
+                f'The queue is full ({governor.max_queue} songs).' if liked else 'Your liked songs could not be loaded.',
+                ephemeral=True
+            )
+            return self.bot.deletions.schedule(msg.delete, 5)
+
+        try:
+            await self._upgrade_likes(itr.guild.id, player.node, allowed)
+            encoded = [item.encoded for item in allowed if item.encoded]
+            async with governor.slot(itr.guild.id):
+                tracks = await decode_valid_tracks(player.node, encoded)
+        except pomice.PomiceException:
+            return await itr.followup.send(UNAVAILABLE, ephemeral=True)
 
-            track: Track = player.build_track(item['song'])
+        for track in tracks:
             track.requester = itr.user
 
-            await player.queue.put(track)
-            if not player.is_playing:
-                await player.play(player.queue.get())
+        player.queue.extend(tracks)
+        if not player.is_playing and not player.queue.is_empty:
+            await player.play(player.queue.get())
 
-        await player.update_queue(self.db)
+        await player.update_queue(self.parent.guilds)
 
-        self.success.description = f'Added {len(liked_music_list)} Liked songs to the queue'
+        self.success.description = f'Added {len(tracks)} Liked songs to the queue'
+        if len(allowed) < len(liked):
+            self.success.description += f' ({len(liked) - len(allowed)} skipped by the queue limits)'
+        if len(tracks) < len(allowed) or len(liked) < len(liked_music_list):
+            self.success.description += ' (some could no longer be loaded)'
         msg = await itr.followup.send(embed=self.success, ephemeral=True)
-        await asyncio.sleep(5)
-        return await msg.delete()
+        return self.bot.deletions.schedule(msg.delete, 5)
+
+    async def _upgrade_likes(self, guild_id: int, node: pomice.Node, likes: list) -> None:
+        """ Load the encoded track of likes saved before favorite_music stored them, and write it back once """
+        async def load(like):
+            # Those likes only kept the identifier, a YouTube video id can be loaded directly
+            async with governor.slot(guild_id):
+                try:
+                    tracks = await node.get_tracks(f'https://www.youtube.com/watch?v={like.song}')
+                except pomice.exceptions.TrackLoadError:
+                    return
+            if tracks and not isinstance(tracks, pomice.Playlist):
+                like['encoded'] = tracks[0].track_id
+
+        old = [like for like in likes if not like.encoded and YOUTUBE_ID.match(like.song)]
+        # A few at a time, so one long list of old likes never fills the backlog every guild's searches share
+        try:
+            for start in range(0, len(old), INGEST_CONCURRENCY):
+                await asyncio.gather(*(load(like) for like in old[start:start + INGEST_CONCURRENCY]))
+        finally:
+            # Keep what was loaded before a failure, the next press only has the rest left
+            upgraded = [(like.encoded, like.id) for like in old if like.encoded]
+            if upgraded:
+                await self.db.executemany("UPDATE favorite_music SET encoded = %s WHERE id = %s", upgraded)
 
 class MusicClipModal(discord.ui.Modal, title='Song Timestamp'):
     def __init__(self, end_time):
@@ -365,13 +435,139 @@ class MusicClipModal(discord.ui.Modal, title='Song Timestamp'):
                     f'Started song from {start_minute}:{start_second} To {end_minute}:{end_second}')
                 self.value = [start_milliseconds, end_milliseconds]
                 self.stop()
-                await asyncio.sleep(5)
-                return await msg.delete()
+                return interaction.client.deletions.schedule(msg.delete, 5)
 
         msg = await interaction.followup.send('Incorrect Format, Please try again', ephemeral=True)
-        await asyncio.sleep(5)
-        await msg.delete()
+        interaction.client.deletions.schedule(msg.delete, 5)
         return self.stop()
 
     async def on_timeout(self) -> None:
         self.stop()
+
+
+class QueuePages:
+    """ Queue embeds built on access from a window of the queue, so only the page being shown is read """
+
+    def __init__(self, player: MusicPlayer, guilds: 'GuildRegistry', per_page: int = 10):
+        self.player = player
+        self.guilds = guilds
+        self.per_page = per_page
+
+    def __len__(self) -> int:
+        return max(1, -(-self.player.queue.count // self.per_page))
+
+    def entries(self, page: int) -> List[QueueEntry]:
+        start = page * self.per_page
+        return self.player.queue.window(start, start + self.per_page)
+
+    def __getitem__(self, page: int) -> discord.Embed:
+        if not 0 <= page < len(self):
+            raise IndexError(page)
+
+        desc = [
+            f"**{i}. {entry.title}** [{entry.author} ({get_duration(entry.length)})]({entry.uri})"
+            for i, entry in enumerate(self.entries(page), start=page * self.per_page + 1)
+        ]
+        embed = discord.Embed(
+            title=f'Queue | {self.player.queue.count} Songs',
+            description="\n".join(desc) or "The queue is currently empty.",
+            color=self.player.color
+        )
+        embed.set_footer(text=f'Page {page + 1}/{len(self)}')
+        return embed
+
+
+class QueueSelect(discord.ui.Select):
+    def __init__(self):
+        super().__init__(placeholder='Pick a song on this page', row=2, options=[SelectOption(label='-')])
+        self.entries: List[QueueEntry] = []
+
+    def show(self, entries: List[QueueEntry], start: int) -> None:
+        self.entries = entries
+        self.disabled = not entries
+        self.options = [
+            SelectOption(label=f'{start + i}. {entry.title}'[:100], description=entry.author[:100], value=str(i))
+            for i, entry in enumerate(entries)
+        ] or [SelectOption(label='The queue is empty')]
+
+    async def callback(self, itr: Interaction):
+        view: 'QueueBrowser' = self.view
+        view.selected = self.entries[int(self.values[0])]
+        for option in self.options:
+            option.default = option.value == self.values[0]
+
+        view.play_next.disabled = view.remove_song.disabled = False
+        await itr.response.edit_message(view=view)
+
+
+class QueueBrowser(PageView):
+    """ The whole queue one page at a time, with jump to position and actions on a song of the page shown """
+
+    def __init__(self, author: discord.User, pages: QueuePages, limited: bool):
+        super().__init__(author, pages, limited)
+        self.pages: QueuePages
+        self.selected: Optional[QueueEntry] = None
+        self.select = QueueSelect()
+        self.add_item(self.select)
+
+    @property
+    def player(self) -> MusicPlayer:
+        return self.pages.player
+
+    def render_page(self) -> discord.Embed:
+        # The queue may have shrunk since the last page was shown
+        self.current_page = min(self.current_page, len(self.pages) - 1)
+        self.selected = None
+        self.select.show(self.pages.entries(self.current_page), self.current_page * self.pages.per_page + 1)
+        self.play_next.disabled = self.remove_song.disabled = True
+        return super().render_page()
+
+    @discord.ui.button(label='Jump to', style=ButtonStyle.gray, row=3)
+    async def jump(self, itr: Interaction, _: Button):
+        await itr.response.send_modal(QueueJumpModal(self))
+
+    @discord.ui.button(label='Play next', style=ButtonStyle.green, row=3, disabled=True)
+    async def play_next(self, itr: Interaction, _: Button):
+        if (index := await self._selected_index(itr)) is not None:
+            self.player.queue.move(index, 0)
+            await self._changed(itr)
+
+    @discord.ui.button(label='Remove', style=ButtonStyle.red, row=3, disabled=True)
+    async def remove_song(self, itr: Interaction, _: Button):
+        if (index := await self._selected_index(itr)) is not None:
+            self.player.queue.remove(index)
+            await self._changed(itr)
+
+    async def _selected_index(self, itr: Interaction) -> Optional[int]:
+        if not same_vc(itr, self.player):
+            await itr.response.send_message('You must be in the same VC to operate', ephemeral=True)
+            itr.client.deletions.schedule(itr.delete_original_response, 5)
+            return None
+
+        try:
+            return self.player.queue.index(self.selected)
+        except ValueError:
+            await itr.response.send_message('That song is no longer in the queue.', ephemeral=True)
+            itr.client.deletions.schedule(itr.delete_original_response, 5)
+            return None
+
+    async def _changed(self, itr: Interaction) -> None:
+        await self.player.update_queue(self.pages.guilds)
+        await self.update_children(itr)
+
+
+class QueueJumpModal(discord.ui.Modal, title='Jump to position'):
+    def __init__(self, browser: QueueBrowser):
+        super().__init__(timeout=60)
+        self.browser = browser
+        self.position = discord.ui.TextInput(label=f'Position (1-{max(browser.player.queue.count, 1)})', max_length=6)
+        self.add_item(self.position)
+
+    async def on_submit(self, interaction: Interaction) -> None:
+        if not self.position.value.isdigit():
+            await interaction.response.send_message('Please enter a position number.', ephemeral=True)
+            return interaction.client.deletions.schedule(interaction.delete_original_response, 5)
+
+        position = min(max(int(self.position.value), 1), max(self.browser.player.queue.count, 1))
+        self.browser.current_page = (position - 1) // self.browser.pages.per_page
+        await self.browser.update_children(interaction)
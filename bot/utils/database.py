@@ -54,6 +54,12 @@ class Database(object):
                 await cur.execute(sql, args)
                 await conn.commit()
 
+    async def executemany(self, sql, args: list) -> None:
+        async with self.music.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(sql, args)
+                await conn.commit()
+
     async def fetchone(self, sql, *args) -> Optional[AttrDict]:
         async with self.music.acquire() as conn:
             conn: aiomysql.Connection
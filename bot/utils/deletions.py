@@ -0,0 +1,79 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+class DeletionScheduler:
+    """
+    Owns every delayed message deletion.
+    Deletions wait in one heap ordered by due time and a single task runs them in rate-limited batches.
+    """
+
+    def __init__(self, batch_size: int = 5, interval: float = 1.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.deleted = 0
+        self.failed = 0
+        self._heap: List[Tuple[float, int, Callable[[], Awaitable]]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, delete: Callable[[], Awaitable], delay: float) -> None:
+        """ Call `delete`, e.g. `message.delete` or `itr.delete_original_response`, after `delay` seconds """
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), delete))
+
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        while self._heap:
+            wait = self._heap[0][0] - time.monotonic()
+            if wait > 0:
+                # Sleep until the earliest deletion is due, or a sooner one is scheduled
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.monotonic()
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._heap)[2])
+
+            await asyncio.gather(*(self._delete(delete) for delete in batch))
+
+            if self._heap and self._heap[0][0] <= time.monotonic():
+                await asyncio.sleep(self.interval)
+
+    async def _delete(self, delete: Callable[[], Awaitable]) -> None:
+        try:
+            await delete()
+            self.deleted += 1
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            self.failed += 1
+            log.warning(f"Failed to delete a message: {e}")
+
+    def stats(self) -> dict:
+        return {'pending': self.pending, 'deleted': self.deleted, 'failed': self.failed}
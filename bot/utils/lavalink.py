@@ -0,0 +1,377 @@
+import asyncio
+from collections import deque
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional
+
+import aiohttp
+from pomice import Node, NodePool, Player
+from pomice.exceptions import NodeCreationError, NoNodesAvailable, PomiceException
+from pomice.utils import ExponentialBackoff
+from websockets import exceptions
+
+if TYPE_CHECKING:
+    from bot import MyBot
+    from bot.utils.database import Database
+
+log = logging.getLogger(__name__)
+
+RESUME_TIMEOUT = int(os.getenv("LAVALINK_RESUME_TIMEOUT", 60))
+
+
+class NodeConfig(NamedTuple):
+    identifier: str
+    host: str
+    port: int
+    password: str
+
+
+def node_configs(is_docker: bool = False) -> List[NodeConfig]:
+    """
+    Read the Lavalink nodes from the environment.
+    LAVALINK_NODES is a comma separated list of `identifier@host:port` sharing LAVALINK_PASSWORD,
+    without it a single node is built from LAVALINK_HOST and LAVALINK_PORT.
+    """
+    password = os.environ["LAVALINK_PASSWORD"]
+    nodes = os.getenv("LAVALINK_NODES")
+
+    if not nodes:
+        host = os.environ["LAVALINK_HOST"] if not is_docker else "lavalink"
+        port = int(os.environ["LAVALINK_PORT"])
+        identifier = os.environ.get("LAVALINK_IDENTIFIER", "MAIN")
+        return [NodeConfig(identifier, host, port, password)]
+
+    configs = []
+    for entry in nodes.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        identifier, _, address = entry.rpartition('@')
+        host, _, port = address.partition(':')
+        configs.append(NodeConfig(identifier or host, host, int(port or 2333), password))
+
+    return configs
+
+
+class LoadAwareNode(Node):
+    """ Node that keeps the frame stats pomice drops from Lavalink `stats` messages """
+
+    __slots__ = ("frame_stats", "resumed", "on_session")
+
+    def __init__(
+        self, *args, session_id: Optional[str] = None,
+        on_session: Optional[Callable[['LoadAwareNode'], Awaitable]] = None, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.frame_stats: Dict[str, Any] = {}
+        self.resumed = False
+        self.on_session = on_session
+
+        # Lavalink resumes the session named in this header when the websocket connects
+        if session_id:
+            self._headers["Session-Id"] = session_id
+
+    async def _listen(self) -> None:
+        # pomice destroys every player when the websocket closes, here they are
+        # left attached so NodeMonitor can move them or resume them on reconnect.
+        while True:
+            try:
+                msg = await self._websocket.recv()
+            except exceptions.ConnectionClosed:
+                self._available = False
+                self._task = None
+                log.warning(f"Lavalink node {self._identifier} disconnected.")
+                return
+
+            self._loop.create_task(self._handle_ws_msg(data=json.loads(msg)))
+
+    async def _handle_ws_msg(self, data: dict) -> None:
+        op = data.get("op")
+        if op == "stats":
+            self.frame_stats = data.get("frameStats") or {}
+        elif op == "ready":
+            self.resumed = data.get("resumed", False)
+            self._headers["Session-Id"] = data["sessionId"]
+
+        await super()._handle_ws_msg(data)
+
+        if op == "ready" and self.on_session:
+            await self.on_session(self)
+
+    async def _configure_resuming(self) -> None:
+        # Keep this session's players alive on Lavalink while the bot restarts
+        await self.send(
+            method="PATCH",
+            path=f"sessions/{self._session_id}",
+            data={"resuming": True, "timeout": self._resume_timeout},
+        )
+
+
+def node_load(node: Node) -> Dict[str, Any]:
+    stats = getattr(node, '_stats', None)
+    frames = getattr(node, 'frame_stats', {})
+    return {
+        'players': stats.players_total if stats else len(node.players),
+        'playing': stats.players_active if stats else 0,
+        'system_load': (stats.cpu_system_load or 0) if stats else 0,
+        'lavalink_load': (stats.cpu_process_load or 0) if stats else 0,
+        'deficit': frames.get('deficit', 0),
+        'nulled': frames.get('nulled', 0),
+    }
+
+
+def node_penalty(node: Node) -> float:
+    """ Lavalink's load balancing penalty, from playing players, CPU load and missing frames per minute """
+    load = node_load(node)
+    penalty = load['playing'] or len(node.players)
+    penalty += 1.05 ** (100 * load['system_load']) * 10 - 10
+
+    if load['deficit'] or load['nulled']:
+        penalty += 1.03 ** (500 * (load['deficit'] / 3000)) * 600 - 600
+        penalty += (1.03 ** (500 * (load['nulled'] / 3000)) * 300 - 300) * 2
+
+    return penalty
+
+
+def is_node_up(node: Node) -> bool:
+    return node._available and getattr(node, '_websocket', None) is not None and node.is_connected
+
+
+def best_node() -> Node:
+    nodes = [node for node in NodePool._nodes.values() if is_node_up(node)]
+    if not nodes:
+        raise NoNodesAvailable("There are no nodes available.")
+    return min(nodes, key=node_penalty)
+
+
+async def load_node_sessions(db: 'Database') -> Dict[str, str]:
+    if not db.music:
+        return {}
+
+    rows = await db.fetchall("SELECT node_id, session_id FROM lavalink_sessions")
+    return {row['node_id']: row['session_id'] for row in rows}
+
+
+async def save_node_session(db: 'Database', node: Node) -> None:
+    if not db.music:
+        return
+
+    await db.execute(
+        "INSERT INTO lavalink_sessions (node_id, session_id) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE session_id = VALUES(session_id)",
+        node._identifier, node._session_id
+    )
+
+
+async def create_node(bot: 'MyBot', config: NodeConfig, session_id: Optional[str] = None) -> LoadAwareNode:
+    if config.identifier in NodePool._nodes:
+        raise NodeCreationError(f"A node with identifier '{config.identifier}' already exists.")
+
+    node = LoadAwareNode(
+        pool=NodePool,
+        bot=bot,
+        host=config.host,
+        port=config.port,
+        password=config.password,
+        identifier=config.identifier,
+        resume_timeout=RESUME_TIMEOUT,
+        session_id=session_id,
+        on_session=lambda node: save_node_session(bot.db, node),
+    )
+    try:
+        await node.connect()
+    except Exception:
+        await discard_node(node)
+        raise
+
+    NodePool._nodes[node._identifier] = node
+    return node
+
+
+async def discard_node(node: Node) -> None:
+    """ Release what a node that never connected holds, pomice adds its gateway listener and HTTP session up front """
+    node._bot.remove_listener(node._update_handler, "on_socket_response")
+    if node._session and not node._session.closed:
+        await node._session.close()
+
+
+async def discard_orphans(node: Node) -> None:
+    """ Destroy players left on a resumed session that no guild claimed back """
+    players = await node.send(method="GET", path=f"sessions/{node._session_id}/players")
+    for player in players or []:
+        guild_id = int(player["guildId"])
+        if guild_id not in node._players:
+            await node.send(method="DELETE", path=f"sessions/{node._session_id}/players", guild_id=guild_id)
+
+
+async def move_player(player: Player, node: Node) -> None:
+    """ Attach a player to `node`, carrying over its track, position, volume, pause state and filters """
+    track = player.current
+    position = min(int(player.position), track.length) if track else 0
+
+    player.node._players.pop(player.guild.id, None)
+    player._node = node
+    node._players[player.guild.id] = player
+
+    await player._refresh_endpoint_uri(node._session_id)
+    await player._dispatch_voice_update()
+
+    data: Dict[str, Any] = {"volume": player.volume, "paused": player.is_paused}
+    if track:
+        data.update(encodedTrack=track.track_id, position=position)
+    if not player.filters.empty:
+        data["filters"] = player.filters.get_all_payloads()
+
+    await node.send(method="PATCH", path=player._player_endpoint_uri, guild_id=player.guild.id, data=data)
+
+
+class NodeMonitor:
+    """ Watches node websockets and REST latency, reconnects dropped nodes and moves their players elsewhere """
+
+    def __init__(self, bot: 'MyBot', interval: float = 10.0, timeout: float = 5.0, max_failures: int = 3):
+        self.bot = bot
+        self.interval = interval
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.latency: Dict[str, float] = {}
+        self.recoveries: Deque[tuple] = deque(maxlen=50)
+        self._failures: Dict[str, int] = {}
+        self._down_since: Dict[str, float] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._backoff: Dict[str, ExponentialBackoff] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                log.exception("Lavalink health check failed")
+            await asyncio.sleep(self.interval)
+
+    async def check(self) -> None:
+        for node in list(NodePool._nodes.values()):
+            try:
+                if is_node_up(node) and await self._probe(node):
+                    continue
+                await self._recover(node)
+            except Exception:
+                # One node's failure must not skip the health check of the others
+                log.exception(f"Health check of Lavalink node {node._identifier} failed")
+
+        for config in node_configs(self.bot.is_docker):
+            if config.identifier not in NodePool._nodes and self._due(config.identifier):
+                try:
+                    await create_node(self.bot, config)
+                    log.info(f"Lavalink node {config.identifier} started by the health monitor.")
+                except Exception as e:
+                    self._retry_later(config.identifier, e)
+
+    async def _probe(self, node: Node) -> bool:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                node.send(method="GET", path="version", include_version=False), timeout=self.timeout
+            )
+        except (asyncio.TimeoutError, PomiceException, aiohttp.ClientError, OSError) as e:
+            failures = self._failures[node._identifier] = self._failures.get(node._identifier, 0) + 1
+            log.warning(f"Lavalink node {node._identifier} health check failed ({failures}/{self.max_failures}): {e!r}")
+            if failures < self.max_failures:
+                return True
+            node._available = False
+            return False
+
+        self._failures[node._identifier] = 0
+        self.latency[node._identifier] = (time.perf_counter() - start) * 1000
+        return True
+
+    def _due(self, identifier: str) -> bool:
+        return time.monotonic() >= self._retry_at.get(identifier, 0)
+
+    def _retry_later(self, identifier: str, error: Exception) -> None:
+        backoff = self._backoff.setdefault(identifier, ExponentialBackoff(base=2))
+        delay = backoff.delay()
+        self._retry_at[identifier] = time.monotonic() + delay
+        log.warning(f"Lavalink node {identifier} is unavailable, retrying in {delay:.1f}s: {error}")
+
+    async def _recover(self, node: Node) -> None:
+        identifier = node._identifier
+        self._down_since.setdefault(identifier, time.monotonic())
+
+        if node.players:
+            try:
+                target = best_node()
+            except NoNodesAvailable:
+                target = None
+            if target:
+                await self._migrate(node, target)
+
+        if not self._due(identifier):
+            return
+
+        try:
+            await self._reconnect(node)
+            await self._wait_for_session(node)
+        except Exception as e:
+            return self._retry_later(identifier, e)
+
+        for player in list(node.players.values()):
+            try:
+                await move_player(player, node)
+            except Exception as e:
+                log.warning(f"Failed to resume player in guild {player.guild.id} on {identifier}: {e}")
+
+        self._failures[identifier] = 0
+        self._backoff.pop(identifier, None)
+        self._recovered(identifier, node)
+
+    async def _reconnect(self, node: Node) -> None:
+        websocket = getattr(node, '_websocket', None)
+        if websocket and not websocket.closed:
+            await websocket.close()
+        if node._task:
+            node._task.cancel()
+            node._task = None
+
+        # The session may be resumed under the same id, so wait for a fresh ready instead of a new id
+        node._session_id = None
+        await node.connect(reconnect=True)
+
+    async def _wait_for_session(self, node: Node) -> None:
+        deadline = time.monotonic() + self.timeout
+        while node._session_id is None:
+            if time.monotonic() > deadline:
+                node._available = False
+                raise asyncio.TimeoutError("Lavalink did not send a new session in time.")
+            await asyncio.sleep(0.1)
+
+    async def _migrate(self, node: Node, target: Node) -> None:
+        players = list(node.players.values())
+        for player in players:
+            try:
+                await move_player(player, target)
+            except Exception as e:
+                log.warning(f"Failed to move player in guild {player.guild.id} to {target._identifier}: {e}")
+
+        log.info(f"Moved {len(players)} player(s) from {node._identifier} to {target._identifier}.")
+        self._recovered(node._identifier, target)
+
+    def _recovered(self, identifier: str, target: Node) -> None:
+        down_since = self._down_since.pop(identifier, None)
+        if down_since is None:
+            return
+
+        elapsed = time.monotonic() - down_since
+        self.recoveries.append((identifier, target._identifier, elapsed))
+        log.info(f"[Metrics] lavalink_recovery_seconds node={identifier} target={target._identifier} value={elapsed:.3f}")
@@ -9,10 +9,19 @@ DROP TABLE IF EXISTS `favorite_music`;
 CREATE TABLE `favorite_music` (
   `id` int NOT NULL AUTO_INCREMENT,
   `song` text NOT NULL,
+  `encoded` mediumtext DEFAULT NULL,
   `user_id` bigint NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `user_id` (`user_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
+DROP TABLE IF EXISTS `lavalink_sessions`;
+CREATE TABLE `lavalink_sessions` (
+  `node_id` varchar(64) NOT NULL,
+  `session_id` varchar(64) NOT NULL,
+  PRIMARY KEY (`node_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
 DROP TABLE IF EXISTS `music`;
 CREATE TABLE `music` (
   `guild_id` bigint NOT NULL,
@@ -24,6 +33,40 @@ CREATE TABLE `music` (
   UNIQUE KEY `guild_id` (`guild_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
+DROP TABLE IF EXISTS `music_players`;
+CREATE TABLE `music_players` (
+  `guild_id` bigint NOT NULL,
+  `node_id` varchar(64) NOT NULL,
+  `voice_channel_id` bigint NOT NULL,
+  `track` mediumtext DEFAULT NULL,
+  `position` int NOT NULL DEFAULT 0,
+  `loop_mode` varchar(8) DEFAULT NULL,
+  `autoplay` tinyint(1) NOT NULL DEFAULT 0,
+  `volume` smallint NOT NULL DEFAULT 100,
+  `paused` tinyint(1) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`guild_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+DROP TABLE IF EXISTS `music_playlists`;
+CREATE TABLE `music_playlists` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `guild_id` bigint NOT NULL,
+  `name` varchar(64) NOT NULL,
+  `tracks` mediumtext NOT NULL,
+  `track_count` int NOT NULL,
+  `created_by` bigint NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `guild_name` (`guild_id`,`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+DROP TABLE IF EXISTS `music_queue`;
+CREATE TABLE `music_queue` (
+  `guild_id` bigint NOT NULL,
+  `batch` int NOT NULL,
+  `tracks` mediumtext NOT NULL,
+  PRIMARY KEY (`guild_id`,`batch`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
 DROP TABLE IF EXISTS `valorant_crosshairs`;
 CREATE TABLE `valorant_crosshairs` (
   `id` int NOT NULL AUTO_INCREMENT,
@@ -0,0 +1,6 @@
+-- Liked songs keep their encoded Lavalink track so they can be batch decoded.
+-- Rows liked before this migration are filled in by "Play Liked" the first time it loads them,
+-- or when the song is liked again.
+ALTER TABLE `favorite_music`
+  ADD COLUMN `encoded` mediumtext DEFAULT NULL AFTER `song`,
+  ADD KEY `user_id` (`user_id`);
@@ -0,0 +1,26 @@
+-- Lavalink session ids and per-guild player snapshots, restored when the bot restarts.
+CREATE TABLE IF NOT EXISTS `lavalink_sessions` (
+  `node_id` varchar(64) NOT NULL,
+  `session_id` varchar(64) NOT NULL,
+  PRIMARY KEY (`node_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE IF NOT EXISTS `music_players` (
+  `guild_id` bigint NOT NULL,
+  `node_id` varchar(64) NOT NULL,
+  `voice_channel_id` bigint NOT NULL,
+  `track` mediumtext DEFAULT NULL,
+  `position` int NOT NULL DEFAULT 0,
+  `loop_mode` varchar(8) DEFAULT NULL,
+  `autoplay` tinyint(1) NOT NULL DEFAULT 0,
+  `volume` smallint NOT NULL DEFAULT 100,
+  `paused` tinyint(1) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`guild_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE IF NOT EXISTS `music_queue` (
+  `guild_id` bigint NOT NULL,
+  `batch` int NOT NULL,
+  `tracks` mediumtext NOT NULL,
+  PRIMARY KEY (`guild_id`,`batch`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -0,0 +1,11 @@
+-- Saved playlists of a guild, stored as newline separated encoded tracks so loading is one batch decode.
+CREATE TABLE IF NOT EXISTS `music_playlists` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `guild_id` bigint NOT NULL,
+  `name` varchar(64) NOT NULL,
+  `tracks` mediumtext NOT NULL,
+  `track_count` int NOT NULL,
+  `created_by` bigint NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `guild_name` (`guild_id`,`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;